@@ -0,0 +1,225 @@
+import asyncio
+import os
+import httpx
+from notion_client import AsyncClient as AsyncNotionClient
+import youtube_api
+from clients import GEMINI_MODEL, close_gemini_model_async, new_gemini_model
+from notion_blocks import create_page_async, page_blocks, page_properties
+from notion_writer import call_with_retry_async, get_rate_limiter
+from summarizer import summarize_transcript_async
+from summary_cache import get_summary_cache, summary_cache_key
+from ledger import content_hash, open_ledger
+from skips import PermanentSkip
+from youtube_api import VIDEOS_LIST_MAX_IDS, YOUTUBE_API_BASE, chunked, parse_video_items
+
+# ステージごとの同時実行数（環境変数で上書き可能）
+ASYNC_METADATA_CONCURRENCY = int(os.environ.get("ASYNC_METADATA_CONCURRENCY", "32"))
+ASYNC_CAPTION_CONCURRENCY = int(os.environ.get("ASYNC_CAPTION_CONCURRENCY", "4"))
+ASYNC_SUMMARIZE_CONCURRENCY = int(os.environ.get("ASYNC_SUMMARIZE_CONCURRENCY", "16"))
+ASYNC_SAVE_CONCURRENCY = int(os.environ.get("ASYNC_SAVE_CONCURRENCY", "3"))
+
+async def get_video_ids_from_channel_async(channel_id, api_key, max_results=3, backend=None, watermarks=None):
+    """
+    youtube_apiの探索処理をスレッドで実行する（チャンネルごとに数回の呼び出しなので、非同期版は持たない）。
+    """
+    if watermarks is not None:
+        # 探索に失敗したチャンネルはtrackせず、ウォーターマークを進めない
+        try:
+            videos = await asyncio.to_thread(
+                youtube_api.discover_new_videos, channel_id, api_key, watermarks.get(channel_id), max_results, backend
+            )
+        except Exception as e:
+            print(f"[ERROR] Exception in get_video_ids_from_channel_async: {e}")
+            return []
+        watermarks.track(channel_id, videos)
+        return [video["video_id"] for video in videos]
+    return await asyncio.to_thread(youtube_api.discover_video_ids, channel_id, api_key, max_results, backend)
+
+async def get_video_infos_async(client, video_ids, api_key):
+    """
+    get_video_infos の非同期版。50件ずつのチャンクを並行して取得する。
+    """
+    async def fetch_chunk(chunk):
+        params = {"key": api_key, "id": ",".join(chunk), "part": "snippet"}
+        try:
+            resp = await client.get(f"{YOUTUBE_API_BASE}/videos", params=params)
+            resp.raise_for_status()
+            return parse_video_items(resp.json())
+        except Exception as e:
+            print(f"[ERROR] Exception in get_video_infos_async: {e}")
+            return {}
+
+    chunks = chunked(dict.fromkeys(video_ids), VIDEOS_LIST_MAX_IDS)
+    infos = {}
+    for chunk_infos in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+        infos.update(chunk_infos)
+    print(f"[DEBUG] Fetched video info for {len(infos)} videos in {len(chunks)} request(s)")
+    return infos
+
+async def summarize_with_gemini_async(model, caption, title, description, model_name=GEMINI_MODEL):
+    print(f"[DEBUG] summarize_with_gemini_async: title={title}, description={description[:30]}... (truncated)")
+    try:
+        # キャッシュキーの計算（字幕ファイルを読む）とキャッシュの読み書き（SQLite・ファイル）はスレッドで行う
+        cache = get_summary_cache()
+        cache_key = await asyncio.to_thread(summary_cache_key, caption, title, description, model_name)
+        summary = await asyncio.to_thread(cache.get, cache_key)
+        if summary:
+            print(f"[DEBUG] Summary cache hit: title={title}")
+            return summary
+        summary = await summarize_transcript_async(model, caption, title, description)
+        print(f"[DEBUG] Gemini response received")
+        await asyncio.to_thread(cache.set, cache_key, summary)
+        return summary
+    except PermanentSkip:
+        raise
+    except Exception as e:
+        print(f"[ERROR] Exception in summarize_with_gemini_async: {e}")
+        return None
+
+async def save_to_notion_async(notion, database_id, video_info, summary, limiter):
+    print(f"[DEBUG] save_to_notion_async: title={video_info['title']}")
+    try:
+        video_info["page_id"] = await create_page_async(
+            notion,
+            database_id,
+            page_properties(video_info),
+            page_blocks(summary, video_info['caption']),
+            request=lambda fn, **kwargs: call_with_retry_async(limiter, fn, **kwargs),
+        )
+        print(f"[DEBUG] Notion page created for: {video_info['title']}")
+        return True
+    except Exception as e:
+        print(f"[ERROR] Exception in save_to_notion_async: {e}")
+        return False
+
+async def record_saved_page_async(ledger, notion, limiter, video_id, digest, page_id):
+    """
+    notion_writer.record_saved_page の非同期版。
+    """
+    previous = await asyncio.to_thread(ledger.page_id, video_id)
+    await asyncio.to_thread(ledger.record, video_id, digest, page_id)
+    if not previous or previous == page_id:
+        return
+    try:
+        await call_with_retry_async(limiter, notion.pages.update, page_id=previous, archived=True)
+        print(f"[DEBUG] Archived replaced page {previous} for video_id={video_id}")
+    except Exception as e:
+        print(f"[ERROR] Failed to archive replaced page {previous}: {e}")
+
+async def process_channels_async(channels, youtube_api_key, gemini_api_key, notion_token, database_id, caption_fetcher, backend=None, ledger=None, watermarks=None):
+    """
+    チャンネル一覧（channels.load_channelsの戻り値）の最新動画をasyncioで並行処理する。
+    字幕取得(caption_fetcher)は同期関数のためスレッドに逃がして実行する。
+    台帳(ledger)に同じ内容（タイトル・説明）で記録済みの動画は字幕取得より前にスキップする。
+    保存まで完了した動画数を返す。
+    """
+    metadata_sem = asyncio.Semaphore(ASYNC_METADATA_CONCURRENCY)
+    caption_sem = asyncio.Semaphore(ASYNC_CAPTION_CONCURRENCY)
+    summarize_sem = asyncio.Semaphore(ASYNC_SUMMARIZE_CONCURRENCY)
+    save_sem = asyncio.Semaphore(ASYNC_SAVE_CONCURRENCY)
+
+    limits = httpx.Limits(max_connections=ASYNC_METADATA_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+        notion = AsyncNotionClient(auth=notion_token)
+        limiter = get_rate_limiter(notion_token)
+        # Geminiのモデルはこのイベントループ専用に作る（プロセス共有のモデルは前回のループに結びついている）
+        models = {}
+        # 台帳に記録済みの動画、保存まで終わった動画、やり直しても処理できない動画だけを完了とし、
+        # その分だけウォーターマークを進める（一時的な失敗の動画は次回もう一度処理する）
+        completed = set()
+        try:
+            async def process_video(video_id, info, options):
+                title, description, channel = info
+                print(f"[DEBUG] Processing video_id={video_id}: title={title}, channel={channel}")
+                try:
+                    async with caption_sem:
+                        caption = await asyncio.to_thread(caption_fetcher, video_id, options["languages"])
+                    if not caption:
+                        print(f"[DEBUG] Skipping video_id={video_id} due to missing caption")
+                        return False
+                    model = models.get(options["model"])
+                    if model is None:
+                        model = models[options["model"]] = new_gemini_model(gemini_api_key, options["model"])
+                    async with summarize_sem:
+                        summary = await summarize_with_gemini_async(
+                            model, caption, title, description, options["model"]
+                        )
+                except PermanentSkip as e:
+                    print(f"[DEBUG] Skipping video_id={video_id} permanently: {e}")
+                    completed.add(video_id)
+                    return False
+                if not summary:
+                    print(f"[DEBUG] Skipping video_id={video_id} due to failed summary")
+                    return False
+                video_info = {
+                    "title": title,
+                    "url": f"https://www.youtube.com/watch?v={video_id}",
+                    "channel": channel,
+                    "caption": caption,
+                }
+                async with save_sem:
+                    saved = await save_to_notion_async(
+                        notion, database_id, video_info, summary, limiter
+                    )
+                if saved and ledger:
+                    await record_saved_page_async(
+                        ledger, notion, limiter, video_id, content_hash(video_id, title, description),
+                        video_info.get("page_id"),
+                    )
+                return saved
+
+            async def discover(channel):
+                async with metadata_sem:
+                    return await get_video_ids_from_channel_async(
+                        channel["id"], youtube_api_key, channel["max_videos"],
+                        backend=backend, watermarks=watermarks,
+                    )
+
+            video_id_lists = await asyncio.gather(*(discover(c) for c in channels))
+            channels_by_video = {}
+            for channel, ids in zip(channels, video_id_lists):
+                for video_id in ids:
+                    channels_by_video.setdefault(video_id, channel)
+            infos = await get_video_infos_async(client, list(channels_by_video), youtube_api_key)
+            video_ids = []
+            for video_id in channels_by_video:
+                if video_id not in infos:
+                    print(f"[DEBUG] Skipping video_id={video_id} due to missing video info")
+                    continue
+                title, description, _ = infos[video_id]
+                digest = content_hash(video_id, title, description)
+                if ledger and await asyncio.to_thread(ledger.contains, video_id, digest):
+                    print(f"[DEBUG] Skipping video_id={video_id} already in ledger")
+                    completed.add(video_id)
+                    continue
+                video_ids.append(video_id)
+            results = await asyncio.gather(
+                *(process_video(v, infos[v], channels_by_video[v]) for v in video_ids),
+                return_exceptions=True,
+            )
+            for video_id, result in zip(video_ids, results):
+                if isinstance(result, Exception):
+                    print(f"[ERROR] Exception while processing video_id={video_id}: {result}")
+            completed.update(video_id for video_id, result in zip(video_ids, results) if result is True)
+            if watermarks is not None:
+                watermarks.advance_completed(completed)
+            processed = sum(1 for result in results if result is True)
+            print(f"[DEBUG] Processed {processed}/{len(video_ids)} videos (async)")
+            return processed
+        finally:
+            await notion.aclose()
+            # 実行ごとに作ったgrpc.aioのチャネルは、ループが閉じる前に閉じないとプロセスに残り続ける
+            for model in models.values():
+                await close_gemini_model_async(model)
+
+def run(channels, youtube_api_key, gemini_api_key, notion_token, database_id, caption_fetcher, backend=None, ledger_backend=None, watermarks=None):
+    ledger = open_ledger(ledger_backend)
+    try:
+        return asyncio.run(
+            process_channels_async(
+                channels, youtube_api_key, gemini_api_key, notion_token, database_id, caption_fetcher,
+                backend=backend, ledger=ledger, watermarks=watermarks,
+            )
+        )
+    finally:
+        ledger.close()
@@ -0,0 +1,125 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from skips import PermanentSkip
+
+# 指定の言語の字幕がないときに次に試す言語（カンマ区切り）
+CAPTION_FALLBACK_LANGUAGES = [
+    lang.strip() for lang in os.environ.get("CAPTION_FALLBACK_LANGUAGES", "en").split(",") if lang.strip()
+]
+# "0"にすると他言語の字幕を翻訳して使う最後の手段を無効にする
+CAPTION_TRANSLATE = os.environ.get("CAPTION_TRANSLATE", "1") == "1"
+# 最有力の字幕の取得に失敗したとき、残りの候補を同時に取得する数
+CAPTION_PARALLEL_FETCHES = int(os.environ.get("CAPTION_PARALLEL_FETCHES", "3"))
+
+def caption_chain(languages=("ja",)):
+    """
+    字幕の優先順位を (種類, 言語) のリストで返す。種類は "manual" / "auto" / "translate"。
+    既定では 手動ja → 自動ja → 手動en → 自動en → jaへの翻訳 の順になる。
+    """
+    chain = []
+    for lang in [*languages, *(lang for lang in CAPTION_FALLBACK_LANGUAGES if lang not in languages)]:
+        chain.append(("manual", lang))
+        chain.append(("auto", lang))
+    if CAPTION_TRANSLATE and languages:
+        chain.append(("translate", languages[0]))
+    return chain
+
+def _find(tracks, lang):
+    """
+    言語コードが一致するトラックを探す（"ja" は "ja-JP" などにも一致させる）。
+    """
+    if lang in tracks:
+        return tracks[lang]
+    for code, track in tracks.items():
+        if code.split("-")[0] == lang:
+            return track
+    return None
+
+def rank_captions(chain, manual, auto, translatable=()):
+    """
+    一覧済みの字幕トラックから、chainの優先順に利用可能な候補を (種類, 言語, トラック) のリストで返す。
+    manual / auto は言語コード -> トラックのdict、translatableは翻訳元にできるトラックのリスト。
+    """
+    candidates = []
+    for kind, lang in chain:
+        if kind == "translate":
+            track = translatable[0] if translatable else None
+        else:
+            track = _find(manual if kind == "manual" else auto, lang)
+        if track is None:
+            continue
+        # 同じトラックが複数の言語指定に一致した場合は一度だけ候補にする
+        if kind != "translate" and any(track is other for _, _, other in candidates):
+            continue
+        candidates.append((kind, lang, track))
+    return candidates
+
+def fetch_best(candidates, fetch, parallel=None, discard=None):
+    """
+    最も優先度の高い候補をfetch(種類, 言語, トラック)で取得する。
+    失敗したか空だった場合は、残りの候補を同時に取得して優先度が最も高い結果を使う。
+    (種類, 言語, 結果) を返し、どの候補も取得できなければNoneを返す。
+    discardを渡すと、同時に取得して使わなかった結果をそれで後始末する（一時ファイルの削除など）。
+    """
+    def attempt(candidate):
+        kind, lang, track = candidate
+        try:
+            return fetch(kind, lang, track)
+        except Exception as e:
+            print(f"[DEBUG] Failed to fetch {kind} caption ({lang}): {e}")
+            return None
+
+    if not candidates:
+        return None
+    result = attempt(candidates[0])
+    if result:
+        return candidates[0][0], candidates[0][1], result
+    rest = candidates[1:]
+    if not rest:
+        return None
+    with ThreadPoolExecutor(max_workers=max(1, parallel or CAPTION_PARALLEL_FETCHES)) as executor:
+        results = list(executor.map(attempt, rest))
+    best = None
+    for (kind, lang, _), result in zip(rest, results):
+        if not result:
+            continue
+        if best is None:
+            best = kind, lang, result
+        elif discard is not None:
+            discard(result)
+    return best
+
+def fetch_transcript_api_segments(video_id, languages=("ja",)):
+    """
+    youtube_transcript_apiで字幕の一覧を1回だけ取得し、優先順位に従って最適な字幕を取得する。
+    ({"text", "start", "duration"}のリスト, 取得元の説明) を返し、どの候補も取得できなければ (None, None) を返す。
+    候補になる字幕トラックが1つもなければPermanentSkipを送出する。
+    一覧の取得で起きた例外（字幕無効・IPブロックなど）はそのまま送出する。
+    """
+    # youtube_transcript_apiは字幕取得ステージで初めて読み込む（コールドスタート短縮のため）
+    from youtube_transcript_api import YouTubeTranscriptApi
+    transcript_list = list(YouTubeTranscriptApi().list(video_id))
+    manual = {t.language_code: t for t in transcript_list if not t.is_generated}
+    auto = {t.language_code: t for t in transcript_list if t.is_generated}
+    # 翻訳元は手動字幕を優先する
+    translatable = sorted(
+        (t for t in transcript_list if t.is_translatable), key=lambda t: t.is_generated
+    )
+    candidates = rank_captions(caption_chain(languages), manual, auto, translatable)
+    if not candidates:
+        raise PermanentSkip(f"no caption track for video_id={video_id}")
+
+    def fetch(kind, lang, transcript):
+        if kind == "translate":
+            transcript = transcript.translate(lang)
+        return [
+            {"text": item['text'], "start": item.get('start'), "duration": item.get('duration')}
+            for item in transcript.fetch().to_raw_data()
+        ]
+
+    best = fetch_best(candidates, fetch)
+    if best is None:
+        return None, None
+    kind, lang, segments = best
+    print(f"[DEBUG] Using {kind} caption ({lang}) for video_id={video_id}")
+    return segments, f"youtube_transcript_api:{kind}:{lang}"
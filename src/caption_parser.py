@@ -0,0 +1,159 @@
+import html
+import json
+import re
+
+# WebVTTのタイミング行（"00:00:01.000 --> 00:00:03.000 align:start position:0%"）
+VTT_TIMING = re.compile(r"^\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})\s+-->\s+((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})")
+# 字幕本文中のタグ（<c>、<00:00:01.000> などの単語単位のタイムスタンプ、<i> など）
+INLINE_TAG = re.compile(r"<[^>]*>")
+# 直近いくつの行と比較して重複を除くか（自動字幕は前の行を繰り返しながら表示する）
+DEDUPE_WINDOW = 2
+
+def _seconds(timestamp):
+    parts = timestamp.replace(",", ".").split(":")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def _clean(text):
+    return html.unescape(INLINE_TAG.sub("", text)).replace(" ", " ").strip()
+
+def parse_vtt(lines):
+    """
+    WebVTTの行のイテレータを読み、字幕の1行ごとに {"text", "start", "duration"} をyieldする。
+    ヘッダ・NOTE/STYLE/REGIONブロック・キューIDは読み飛ばし、本文のタグは取り除く。
+    """
+    start = end = None
+    in_cue = False
+    skipping = False
+    for line in lines:
+        line = line.rstrip("\r\n")
+        # キューは空行で終わる（自動字幕はキュー内に空白だけの行を含むので、それでは終わらせない）
+        if not line:
+            in_cue = skipping = False
+            continue
+        if skipping:
+            continue
+        if in_cue:
+            text = _clean(line)
+            if text:
+                yield {"text": text, "start": start, "duration": round(end - start, 3)}
+            continue
+        if not line.strip():
+            continue
+        match = VTT_TIMING.match(line)
+        if match:
+            start, end = _seconds(match.group(1)), _seconds(match.group(2))
+            in_cue = True
+        elif line.startswith(("WEBVTT", "NOTE", "STYLE", "REGION")):
+            skipping = True
+        # それ以外はキューIDなので無視する
+
+def parse_srv3(lines):
+    """
+    YouTubeのsrv3（timedtext format 3のXML）を逐次パースし、<p>要素ごとにセグメントをyieldする。
+    """
+    import xml.etree.ElementTree as ET
+    parser = ET.XMLPullParser(events=("end",))
+    for line in lines:
+        parser.feed(line + "\n")
+        for _, element in parser.read_events():
+            if element.tag != "p":
+                continue
+            text = _clean("".join(element.itertext()))
+            if text:
+                start = int(element.get("t", 0)) / 1000
+                duration = int(element.get("d", 0)) / 1000
+                yield {"text": text, "start": start, "duration": duration}
+            element.clear()
+    parser.close()
+
+def _iter_json_array(lines, key):
+    """
+    JSONオブジェクトの行（または任意の位置で区切った断片）のイテレータから、
+    キーkeyの配列の要素を1つずつデコードしてyieldする。
+    デコード済みの部分はバッファから捨てるので、文書全体を1つの文字列にしない。
+    """
+    decoder = json.JSONDecoder()
+    lines = iter(lines)
+    buffer = ""
+    pos = None
+    # "key": [ の直後まで読む
+    while pos is None:
+        line = next(lines, None)
+        if line is None:
+            return
+        buffer += line
+        match = re.search(rf'"{re.escape(key)}"\s*:\s*\[', buffer)
+        if match:
+            pos = match.end()
+    while True:
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # 要素の途中までしか読んでいないので次の行を足す
+            line = next(lines, None)
+            if line is None:
+                raise
+            buffer = buffer[pos:] + line
+            pos = 0
+            continue
+        yield item
+        buffer, pos = buffer[end:], 0
+
+def parse_json3(lines):
+    """
+    YouTubeのjson3を逐次パースし、イベントごとにセグメントをyieldする。
+    """
+    for event in _iter_json_array(lines, "events"):
+        text = _clean("".join(seg.get("utf8", "") for seg in event.get("segs") or []))
+        if text:
+            start = event.get("tStartMs", 0) / 1000
+            duration = event.get("dDurationMs", 0) / 1000
+            yield {"text": text, "start": start, "duration": duration}
+
+PARSERS = {
+    "vtt": parse_vtt,
+    "srv3": parse_srv3,
+    "json3": parse_json3,
+}
+
+# 字幕の形式の優先順位（小さく、パースが軽いものから）
+CAPTION_FORMATS = ("json3", "srv3", "vtt")
+
+def pick_format(formats):
+    """
+    yt-dlpの字幕フォーマットのリストから、パースできる最も優先度の高いものを返す。
+    """
+    for ext in CAPTION_FORMATS:
+        for fmt in formats:
+            if fmt.get('ext') == ext:
+                return fmt
+    return None
+
+def dedupe_segments(segments, window=DEDUPE_WINDOW):
+    """
+    直前window行のいずれかと同じ本文のセグメントを除く（自動字幕のロールアップ表示による重複対策）。
+    """
+    recent = []
+    for segment in segments:
+        if segment["text"] in recent:
+            continue
+        recent.append(segment["text"])
+        if len(recent) > window:
+            recent.pop(0)
+        yield segment
+
+def parse_captions(lines, fmt="vtt"):
+    """
+    字幕ファイルの行のイテレータを形式に応じてパースし、重複を除いたセグメントのジェネレータを返す。
+    """
+    parser = PARSERS.get(fmt)
+    if parser is None:
+        raise ValueError(f"Unsupported caption format: {fmt}")
+    return dedupe_segments(parser(lines))
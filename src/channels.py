@@ -0,0 +1,107 @@
+import json
+import os
+import re
+import threading
+from clients import GEMINI_MODEL
+
+# チャンネル一覧ファイル（.json / .toml / .yaml）
+CHANNELS_FILE = os.environ.get(
+    "CHANNELS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "channels.json")
+)
+
+CHANNEL_ID_PATTERN = re.compile(r"^UC[0-9A-Za-z_-]{22}$")
+DEFAULT_OPTIONS = {
+    "languages": ["ja"],
+    "max_videos": 3,
+    "priority": 0,
+}
+
+# パスごとの読み込み結果（更新時刻が変わらない限りウォームスタートでも再利用する）
+_cache = {}
+_lock = threading.Lock()
+
+class ChannelRegistryError(ValueError):
+    pass
+
+def _parse(path, text):
+    if path.endswith(".toml"):
+        import tomllib
+        return tomllib.loads(text)
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ChannelRegistryError("PyYAML is required to read YAML channel files")
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+def _validate(data, path):
+    if not isinstance(data, dict) or not isinstance(data.get("channels"), list):
+        raise ChannelRegistryError(f"{path}: top level must contain a 'channels' list")
+    defaults = dict(DEFAULT_OPTIONS, model=GEMINI_MODEL)
+    defaults.update(data.get("defaults") or {})
+
+    channels = []
+    seen = set()
+    for index, entry in enumerate(data["channels"]):
+        where = f"{path}: channels[{index}]"
+        if not isinstance(entry, dict):
+            raise ChannelRegistryError(f"{where} must be a table/object")
+        channel = dict(defaults)
+        channel.update(entry)
+        channel_id = channel.get("id")
+        if not isinstance(channel_id, str) or not CHANNEL_ID_PATTERN.match(channel_id):
+            raise ChannelRegistryError(f"{where}: invalid channel id {channel_id!r}")
+        if channel_id in seen:
+            raise ChannelRegistryError(f"{where}: duplicate channel id {channel_id}")
+        seen.add(channel_id)
+        languages = channel["languages"]
+        if isinstance(languages, str):
+            languages = [languages]
+        if not languages or not all(isinstance(lang, str) and lang for lang in languages):
+            raise ChannelRegistryError(f"{where}: languages must be a non-empty list of strings")
+        for key in ("max_videos", "priority"):
+            if not isinstance(channel[key], int) or isinstance(channel[key], bool):
+                raise ChannelRegistryError(f"{where}: {key} must be an integer")
+        if channel["max_videos"] < 1:
+            raise ChannelRegistryError(f"{where}: max_videos must be at least 1")
+        if not isinstance(channel["model"], str) or not channel["model"]:
+            raise ChannelRegistryError(f"{where}: model must be a non-empty string")
+        channels.append({
+            "id": channel_id,
+            "name": channel.get("name", ""),
+            "languages": list(languages),
+            "max_videos": channel["max_videos"],
+            "priority": channel["priority"],
+            "model": channel["model"],
+        })
+    # 優先度の高いチャンネルから処理する
+    channels.sort(key=lambda channel: -channel["priority"])
+    return channels
+
+def load_channels(path=None):
+    """
+    チャンネル一覧を読み込んで検証し、優先度順のdictのリストを返す。
+    不正な内容があればChannelRegistryErrorを送出する（処理の途中ではなく開始時に失敗させる）。
+    """
+    path = path or CHANNELS_FILE
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError as e:
+        raise ChannelRegistryError(f"Channel file not found: {path}") from e
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = _parse(path, f.read())
+    except ChannelRegistryError:
+        raise
+    except Exception as e:
+        raise ChannelRegistryError(f"{path}: failed to parse: {e}") from e
+    channels = _validate(data, path)
+    with _lock:
+        _cache[path] = (mtime, channels)
+    print(f"[DEBUG] Loaded {len(channels)} channels from {path}")
+    return channels
@@ -0,0 +1,74 @@
+import os
+import threading
+
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-pro")
+
+# プロセス内で共有するクライアント。Lambdaのウォームスタートでも再利用される。
+_notion_clients = {}
+_gemini_models = {}
+_configured_gemini_key = None
+_lock = threading.Lock()
+
+def get_notion_client(notion_token):
+    """
+    トークンごとにNotionClientを1つだけ作って使い回す。
+    """
+    with _lock:
+        client = _notion_clients.get(notion_token)
+        if client is None:
+            from notion_client import Client as NotionClient
+            client = NotionClient(auth=notion_token)
+            _notion_clients[notion_token] = client
+        return client
+
+def _configure_gemini(api_key):
+    global _configured_gemini_key
+    # google.generativeai（protobuf/grpc込み）は重いので最初に要約するときまで読み込まない
+    import google.generativeai as genai
+    if _configured_gemini_key != api_key:
+        genai.configure(api_key=api_key)
+        _configured_gemini_key = api_key
+        # 設定が変わると既存モデルのクライアントは古いキーを持ったままになる
+        _gemini_models.clear()
+    return genai
+
+def get_gemini_model(api_key, model_name=GEMINI_MODEL):
+    """
+    APIキーとモデル名ごとにGenerativeModelを1つだけ作って使い回す。
+    genai.configureはグローバル設定なので、キーが変わったときだけ呼び直す。
+    """
+    with _lock:
+        genai = _configure_gemini(api_key)
+        model = _gemini_models.get((api_key, model_name))
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            _gemini_models[(api_key, model_name)] = model
+        return model
+
+def _make_async_client():
+    # google-generativeai 0.8.5（requirements.txtで固定）の非公開APIに依存する箇所はここだけにまとめる。
+    # GenerativeModelは非同期クライアントを_async_clientに遅延生成し、既定では_client_managerがプロセス内で共有する1つを使う。
+    # バージョンを上げるときは、この2つの属性が残っているか確認すること。
+    from google.generativeai import client as genai_client
+    return genai_client._client_manager.make_client("generative_async")
+
+def new_gemini_model(api_key, model_name=GEMINI_MODEL):
+    """
+    共有しないGenerativeModelを、専用の非同期クライアントつきで作る。
+    非同期クライアント（grpc.aio）は最初に使ったイベントループに結びつき、既定ではプロセス内で共有されるので、
+    asyncio.runごとに新しいループを作る非同期エンジンでは実行ごとにこちらで作り直し、終わったらclose_gemini_model_asyncで閉じる。
+    """
+    with _lock:
+        genai = _configure_gemini(api_key)
+        model = genai.GenerativeModel(model_name)
+        model._async_client = _make_async_client()
+        return model
+
+async def close_gemini_model_async(model):
+    """
+    new_gemini_modelで作ったモデルの非同期クライアントのgrpcチャネルを閉じる（イベントループが終わる前に呼ぶ）。
+    """
+    client = model._async_client
+    if client is not None:
+        model._async_client = None
+        await client.transport.close()
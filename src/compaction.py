@@ -0,0 +1,165 @@
+import os
+import re
+import unicodedata
+from collections import deque
+from difflib import SequenceMatcher
+from summarizer import SUMMARY_MODE, estimate_tokens
+from transcript_cache import transcript_lines
+
+# "0"にすると字幕を圧縮せずにそのままプロンプトに入れる
+TRANSCRIPT_COMPACTION = os.environ.get("TRANSCRIPT_COMPACTION", "1") == "1"
+# 圧縮後の字幕のトークン数の上限（0なら上限なし。フィラーと重複の除去だけを行う）
+# map-reduceが使えるときは長い字幕もチャンクに分けて全体を要約するので、既定では上限を設けない。
+# 常に1回のプロンプトで要約する"single"モードでは、2時間程度の動画の字幕が収まる量を既定の上限にする
+TRANSCRIPT_TOKEN_BUDGET = int(
+    os.environ.get("TRANSCRIPT_TOKEN_BUDGET", "50000" if SUMMARY_MODE == "single" else "0")
+)
+# 上限に収めるとき、冒頭と末尾にそれぞれ残す割合
+COMPACTION_EDGE_RATIO = float(os.environ.get("COMPACTION_EDGE_RATIO", "0.15"))
+
+# 直近いくつの行と比べて重複を判定するか、どれだけ似ていれば重複とみなすか
+DUPLICATE_WINDOW = 3
+DUPLICATE_RATIO = 0.9
+# これより短い行は「他の行に含まれる」だけでは重複とみなさない（「はい」などの相づちを消さないため）
+CONTAINMENT_MIN_LENGTH = 5
+# 省略した箇所に入れる印
+OMISSION_MARK = "（中略）"
+
+# 自動字幕の注釈（[音楽] [拍手] など）と話者の切り替え記号
+ANNOTATION = re.compile(r"\[[^\]]{0,20}\]|^\s*>>\s*")
+# 伸ばし音を含むなど、それだけでフィラーと分かるもの
+STRONG_FILLER = r"えー*っ?と|ええと|えー+|あのー+|そのー+|うー+ん|んー+|あー+"
+# 「あの人」「その件」「umbrella」のように普通の語の一部にもなるので、直後が区切りのときだけフィラーとみなすもの
+WEAK_FILLER = r"あの|その|まあ|まぁ|uh+|um+|erm"
+FILLER = re.compile(
+    rf"(?:^|(?<=[、。！？!?,\s]))(?:(?:{STRONG_FILLER})|(?:{WEAK_FILLER})(?=[、。！？!?,\s]|$))[、,\s]*",
+    re.IGNORECASE,
+)
+WHITESPACE = re.compile(r"\s+")
+# 情報量の目安にする語（カタカナ語・漢字熟語・英単語・数字）
+TERM = re.compile(r"[ァ-ヶー]{2,}|[一-龥々]{2,}|[A-Za-z][A-Za-z0-9]+|\d+")
+
+def normalize_line(line):
+    """
+    全角英数字などを正規化し、注釈・フィラー・余分な空白を取り除く。
+    """
+    line = unicodedata.normalize("NFKC", line)
+    line = ANNOTATION.sub(" ", line)
+    line = WHITESPACE.sub(" ", line).strip()
+    line = FILLER.sub("", line)
+    return WHITESPACE.sub(" ", line).strip(" 、,")
+
+def _is_duplicate(line, previous):
+    if line == previous:
+        return True
+    if len(line) >= CONTAINMENT_MIN_LENGTH and line in previous:
+        return True
+    return SequenceMatcher(None, line, previous).ratio() >= DUPLICATE_RATIO
+
+def dedupe_lines(lines, window=DUPLICATE_WINDOW):
+    """
+    直近window行とほぼ同じ行を除いてyieldする。前の行を含んで伸びた行（ロールアップ表示）は前の行を置き換える。
+    置き換えられる可能性があるので、残す行は次の行を残すと決まった時点でyieldする。
+    """
+    recent = deque(maxlen=window)
+    for line in lines:
+        if recent and len(recent[-1]) >= CONTAINMENT_MIN_LENGTH and recent[-1] in line:
+            recent[-1] = line
+            continue
+        if any(_is_duplicate(line, previous) for previous in recent):
+            continue
+        if recent:
+            yield recent[-1]
+        recent.append(line)
+    if recent:
+        yield recent[-1]
+
+def _information(line, tokens):
+    return len(set(TERM.findall(line))) / max(1, tokens)
+
+def trim_to_budget(lines, budget, edge_ratio=None):
+    """
+    行のリストを、改行でつないだときにbudgetトークン以内に収める。冒頭と末尾は優先して残し、
+    残りの予算は情報量（語の種類数/トークン数）が多い行から選ぶ。省略した箇所には印を入れ、印と改行も予算に含める。
+    """
+    edge_ratio = COMPACTION_EDGE_RATIO if edge_ratio is None else edge_ratio
+    # 各行の改行の分として1トークンずつ足す（"\n".join後の推定トークン数はこの合計を超えない）
+    tokens = [estimate_tokens(line) + 1 for line in lines]
+    if sum(tokens) <= budget:
+        return lines
+    mark_tokens = estimate_tokens(OMISSION_MARK) + 1
+
+    keep = set()
+    # 予算を超える以上、少なくとも1か所は省略する
+    remaining = budget - mark_tokens
+    edge_budget = min(int(budget * edge_ratio), remaining // 2)
+    for indices in (range(len(lines)), range(len(lines) - 1, -1, -1)):
+        used = 0
+        for i in indices:
+            if i in keep or used + tokens[i] > edge_budget:
+                break
+            keep.add(i)
+            used += tokens[i]
+        remaining -= used
+    middle = sorted(
+        (i for i in range(len(lines)) if i not in keep),
+        key=lambda i: _information(lines[i], tokens[i]),
+        reverse=True,
+    )
+    for i in middle:
+        # 省略している範囲の途中の行を残すと、範囲が2つに分かれて印が1つ増える。端の行なら増えず、範囲が消えれば1つ減る
+        gap_before = i > 0 and i - 1 not in keep
+        gap_after = i < len(lines) - 1 and i + 1 not in keep
+        cost = tokens[i] + (gap_before + gap_after - 1) * mark_tokens
+        if cost <= remaining:
+            keep.add(i)
+            remaining -= cost
+
+    trimmed = []
+    for i in range(len(lines)):
+        if i in keep:
+            trimmed.append(lines[i])
+        elif not trimmed or trimmed[-1] != OMISSION_MARK:
+            trimmed.append(OMISSION_MARK)
+    return trimmed
+
+def compact_lines(lines, budget=None):
+    """
+    字幕の行を正規化・フィラー除去・重複除去し、予算があればトークン数の上限に収めたリストを返す。
+    linesはイテレータでもよい（1行ずつ読みながら処理する）。
+    予算がなければ圧縮した行のジェネレータを返す。予算に収めるには行を選ぶので、圧縮後の行はリストになる。
+    """
+    budget = TRANSCRIPT_TOKEN_BUDGET if budget is None else budget
+    lines = dedupe_lines(line for line in map(normalize_line, lines) if line)
+    if budget > 0:
+        return trim_to_budget(list(lines), budget)
+    return lines
+
+def compact_transcript(caption, budget=None):
+    """
+    字幕（文字列、またはTranscript・セグメントのリスト）を圧縮したテキストを返し、圧縮前後のトークン数を出力する。
+    元の字幕は1行ずつ読むので、全体を1つの文字列にするのは圧縮後のテキストだけになる。
+    """
+    if not TRANSCRIPT_COMPACTION:
+        return caption if isinstance(caption, str) else "\n".join(transcript_lines(caption))
+    before = 0
+
+    def counted(lines):
+        nonlocal before
+        for line in lines:
+            before += estimate_tokens(line)
+            yield line
+
+    compacted = "\n".join(compact_lines(counted(transcript_lines(caption)), budget))
+    after = estimate_tokens(compacted)
+    saved = 100 * (before - after) / before if before else 0
+    print(f"[DEBUG] Transcript compaction: {before} -> {after} tokens ({saved:.1f}% saved)")
+    return compacted
+
+def compaction_fingerprint():
+    """
+    要約キャッシュのキーに含める圧縮の設定（設定を変えると別の要約として扱う）。
+    """
+    if not TRANSCRIPT_COMPACTION:
+        return "compaction=off"
+    return f"compaction=on;budget={TRANSCRIPT_TOKEN_BUDGET};edge={COMPACTION_EDGE_RATIO}"
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+# Geminiのクォータ（1分あたりのリクエスト数・トークン数）
+GEMINI_RPM = int(os.environ.get("GEMINI_RPM", "15"))
+GEMINI_TPM = int(os.environ.get("GEMINI_TPM", "1000000"))
+# 出力トークン数の見込み（入力の推定トークン数に加算して予約する）
+GEMINI_OUTPUT_TOKENS = int(os.environ.get("GEMINI_OUTPUT_TOKENS", "1024"))
+# リトライを諦めるまでの時間（秒）
+GEMINI_DEADLINE_SECONDS = float(os.environ.get("GEMINI_DEADLINE_SECONDS", "300"))
+
+WINDOW_SECONDS = 60.0
+
+_schedulers = {}
+_lock = threading.Lock()
+
+class GeminiScheduler:
+    """
+    直近60秒のリクエスト数とトークン数を数え、RPM/TPMの範囲内でリクエストを通すスケジューラ。
+    429を受けると実効的な上限を半分に下げ、成功が続くと少しずつ元に戻す。
+    """
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.factor = 1.0
+        self.window = deque()
+        self.window_tokens = 0
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.window and now - self.window[0][0] >= WINDOW_SECONDS:
+            _, tokens = self.window.popleft()
+            self.window_tokens -= tokens
+
+    def try_admit(self, tokens):
+        """
+        予算内ならリクエストを記録して0を返す。予算オーバーなら次に試すまでの待ち時間（秒）を返す。
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            rpm = max(1, int(self.rpm * self.factor))
+            tpm = max(1, int(self.tpm * self.factor))
+            # 1件だけでTPMを超えるリクエストは、窓が空いていれば通す
+            fits_tokens = self.window_tokens + tokens <= tpm or not self.window
+            if len(self.window) < rpm and fits_tokens:
+                self.window.append((now, tokens))
+                self.window_tokens += tokens
+                return 0.0
+            return max(0.05, WINDOW_SECONDS - (now - self.window[0][0]))
+
+    def _wait(self, tokens, deadline):
+        delay = self.try_admit(tokens)
+        if delay and deadline is not None and time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Gemini RPM/TPM capacity not available within the deadline ({tokens} tokens)")
+        return delay
+
+    def admit(self, tokens, deadline=None):
+        """
+        予算が空くまで待ってリクエストを記録する。deadline（time.monotonicの時刻）までに空かなければTimeoutErrorを送出する。
+        """
+        while True:
+            delay = self._wait(tokens, deadline)
+            if delay == 0:
+                return
+            time.sleep(delay)
+
+    async def admit_async(self, tokens, deadline=None):
+        while True:
+            delay = self._wait(tokens, deadline)
+            if delay == 0:
+                return
+            await asyncio.sleep(delay)
+
+    def on_success(self):
+        with self.lock:
+            self.factor = min(1.0, self.factor + 0.05)
+
+    def on_throttled(self):
+        with self.lock:
+            self.factor = max(0.1, self.factor / 2)
+
+    def _backoff(self, error, attempt, deadline):
+        # google.api_coreはgrpcを読み込むので、実際にエラーが起きたときだけimportする
+        from google.api_core import exceptions as google_exceptions
+        retryable = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.TooManyRequests,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+        )
+        if not isinstance(error, retryable):
+            return None
+        if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+            self.on_throttled()
+        delay = min(60.0, 2.0 * 2 ** attempt) * (0.5 + random.random())
+        if time.monotonic() + delay > deadline:
+            return None
+        return delay
+
+    def generate(self, model, prompt, tokens, deadline_seconds=GEMINI_DEADLINE_SECONDS, **kwargs):
+        # stream=Trueの場合も最初のチャンクの取得までは呼び出し時に行われるので、429などはここでリトライできる
+        deadline = time.monotonic() + deadline_seconds
+        attempt = 0
+        while True:
+            self.admit(tokens, deadline)
+            try:
+                response = model.generate_content(prompt, **kwargs)
+                self.on_success()
+                return response
+            except Exception as e:
+                delay = self._backoff(e, attempt, deadline)
+                if delay is None:
+                    raise
+                print(f"[DEBUG] Gemini request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    async def generate_async(self, model, prompt, tokens, deadline_seconds=GEMINI_DEADLINE_SECONDS):
+        deadline = time.monotonic() + deadline_seconds
+        attempt = 0
+        while True:
+            await self.admit_async(tokens, deadline)
+            try:
+                response = await model.generate_content_async(prompt)
+                self.on_success()
+                return response
+            except Exception as e:
+                delay = self._backoff(e, attempt, deadline)
+                if delay is None:
+                    raise
+                print(f"[DEBUG] Gemini request failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+def get_gemini_scheduler(model_name):
+    """
+    モデルごとに1つのスケジューラを共有する（クォータはモデル単位のため）。
+    """
+    with _lock:
+        scheduler = _schedulers.get(model_name)
+        if scheduler is None:
+            scheduler = GeminiScheduler()
+            _schedulers[model_name] = scheduler
+        return scheduler
@@ -0,0 +1,62 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# コネクションプールの大きさ（ホストごとの同時接続数）
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "8"))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "16"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+# (接続タイムアウト, 読み込みタイムアウト) 秒
+HTTP_TIMEOUT = (
+    float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")),
+    float(os.environ.get("HTTP_READ_TIMEOUT", "30")),
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    timeoutが指定されていないリクエストにデフォルトのタイムアウトを付けるアダプタ。
+    """
+
+    def __init__(self, *args, timeout=HTTP_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+def create_session():
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """
+    プロセス内で共有するrequests.Sessionを返す。
+    モジュール変数に保持するので、Lambdaのウォームスタートでも接続が再利用される。
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
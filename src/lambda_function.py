@@ -1,10 +1,20 @@
 import os
-import requests
-import xml.etree.ElementTree as ET
-from notion_client import Client as NotionClient
-import google.generativeai as genai
-import time
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+from concurrent.futures import ThreadPoolExecutor
+from clients import GEMINI_MODEL, get_gemini_model
+from http_session import get_session
+from notion_blocks import page_blocks, page_properties
+from notion_writer import get_notion_writer, record_saved_page, stream_summary_to_notion
+from summarizer import SUMMARY_STREAMING, summarize_transcript
+from summary_cache import get_summary_cache, summary_cache_key
+from caption_fallback import fetch_transcript_api_segments
+from transcript_cache import open_transcript, store_transcript
+from pipeline import Stage, run_pipeline
+from channels import ChannelRegistryError, load_channels
+from sharding import dispatch_shards, select_shard, shard_events
+from youtube_api import discover_new_videos, discover_video_ids, get_video_infos
+from watermarks import INCREMENTAL_POLLING, open_watermarks
+from ledger import NullLedger, content_hash, open_ledger
+from skips import PermanentSkip
 
 # 追加: ローカル実行用
 try:
@@ -13,24 +23,27 @@ try:
 except ImportError:
     pass
 
-def get_video_ids_from_channel(channel_id, api_key, max_results=3):
-    url = (
-        "https://www.googleapis.com/youtube/v3/search"
-        f"?key={api_key}&channelId={channel_id}&part=snippet,id&order=date&maxResults={max_results}"
-    )
+# ステージごとの同時実行数（環境変数で上書き可能）
+METADATA_WORKERS = int(os.environ.get("METADATA_WORKERS", "8"))
+CAPTION_WORKERS = int(os.environ.get("CAPTION_WORKERS", "2"))
+SUMMARIZE_WORKERS = int(os.environ.get("SUMMARIZE_WORKERS", "4"))
+SAVE_WORKERS = int(os.environ.get("SAVE_WORKERS", "2"))
+# "thread"（スレッドプールのパイプライン）または "async"（asyncioエンジン）
+SUMMARY_ENGINE = os.environ.get("SUMMARY_ENGINE", "thread")
+
+def get_video_ids_from_channel(channel_id, api_key, max_results=3, backend=None, watermarks=None):
+    # backend: "search" / "playlist" / "rss"（未指定ならDISCOVERY_BACKEND）
+    # watermarksを渡すと前回以降に公開された動画だけを（3件を超えても）すべて返す
+    if watermarks is None:
+        return discover_video_ids(channel_id, api_key, max_results, backend)
+    # 探索に失敗したチャンネルはtrackせず、ウォーターマークを進めない
     try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        data = resp.json()
-        video_ids = [
-            item["id"]["videoId"]
-            for item in data.get("items", [])
-            if item["id"]["kind"] == "youtube#video"
-        ]
-        return video_ids
+        videos = discover_new_videos(channel_id, api_key, watermarks.get(channel_id), max_results, backend)
     except Exception as e:
         print(f"[ERROR] Exception in get_video_ids_from_channel: {e}")
         return []
+    watermarks.track(channel_id, videos)
+    return [video["video_id"] for video in videos]
 
 def get_video_info(video_id, api_key):
     url = (
@@ -38,7 +51,7 @@ def get_video_info(video_id, api_key):
         f"?key={api_key}&id={video_id}&part=snippet"
     )
     try:
-        resp = requests.get(url)
+        resp = get_session().get(url)
         resp.raise_for_status()
         data = resp.json()
         items = data.get("items", [])
@@ -55,20 +68,32 @@ def get_video_info(video_id, api_key):
         print(f"[ERROR] Exception in get_video_info: {e}")
         return None, None, None
 
-def get_japanese_caption(video_id, max_retries=5, wait_seconds=60):
+def get_japanese_caption(video_id, languages=("ja",), max_retries=5, wait_seconds=60):
+    # youtube_transcript_apiは字幕取得ステージで初めて読み込む（コールドスタート短縮のため）
+    from youtube_transcript_api import TranscriptsDisabled, NoTranscriptFound
     try:
         from youtube_transcript_api._errors import RequestBlocked, IPBlocked
     except ImportError:
         from youtube_transcript_api._errors import RequestBlocked
         IPBlocked = RequestBlocked  # ダミーで同じものを使う
+    cache_language = ",".join(languages)
+    # 字幕は文字列にせず、ディスク上のキャッシュへの参照（Transcript）として後段に渡す
+    transcript = open_transcript(video_id, cache_language)
+    if transcript is not None:
+        return transcript
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['ja'])
-        texts = [item['text'] for item in transcript]
-        print(f"[DEBUG] Number of caption lines: {len(texts)}")
-        return "\n".join(texts)
+        # 手動ja → 自動ja → en → jaへの翻訳 の順に、一覧から最適な字幕を選ぶ
+        segments, source = fetch_transcript_api_segments(video_id, languages)
+        if not segments:
+            print(f"[DEBUG] No usable caption found for video_id={video_id}")
+            return None
+        print(f"[DEBUG] Number of caption lines: {len(segments)}")
+        return store_transcript(video_id, cache_language, segments, source=source)
+    except PermanentSkip:
+        raise
     except (TranscriptsDisabled, NoTranscriptFound) as e:
-        print(f"[DEBUG] No Japanese caption found for video_id={video_id}: {e}")
-        return None
+        # 字幕トラックがない動画は何度取得し直しても同じなので、完了扱いにしてウォーターマークを進める
+        raise PermanentSkip(f"no caption track for video_id={video_id}: {e}") from e
     except (RequestBlocked, IPBlocked) as e:
         print(f"[ERROR] IP block detected for video_id={video_id}: {e}. Aborting without retry.")
         return None
@@ -76,48 +101,148 @@ def get_japanese_caption(video_id, max_retries=5, wait_seconds=60):
         print(f"[ERROR] Exception in get_japanese_caption: {e}")
         return None
 
-def summarize_with_gemini(api_key, caption, title, description):
+def summarize_with_gemini(api_key, caption, title, description, model_name=GEMINI_MODEL):
     print(f"[DEBUG] summarize_with_gemini: title={title}, description={description[:30]}... (truncated)")
     try:
-        genai.configure(api_key=api_key)
-        prompt = f"""以下のYouTube動画の内容を日本語で要約してください。
-
-動画タイトル: {title}
-動画説明: {description}
-
-字幕内容:
-{caption}
-
-"""
-        model = genai.GenerativeModel("gemini-pro")
-        response = model.generate_content(prompt)
+        cache = get_summary_cache()
+        cache_key = summary_cache_key(caption, title, description, model_name)
+        summary = cache.get(cache_key)
+        if summary:
+            print(f"[DEBUG] Summary cache hit: title={title}")
+            return summary
+        model = get_gemini_model(api_key, model_name)
+        summary = summarize_transcript(model, caption, title, description)
         print(f"[DEBUG] Gemini response received")
-        return response.text.strip() if hasattr(response, "text") else str(response)
+        cache.set(cache_key, summary)
+        return summary
+    except PermanentSkip:
+        raise
     except Exception as e:
         print(f"[ERROR] Exception in summarize_with_gemini: {e}")
-        return "要約生成中にエラーが発生しました。"
+        return None
 
 def save_to_notion(notion_token, database_id, video_info, summary):
     print(f"[DEBUG] save_to_notion: title={video_info['title']}")
     try:
-        notion = NotionClient(auth=notion_token)
-        notion.pages.create(
-            parent={"database_id": database_id},
-            properties={
-                "Title": {"title": [{"text": {"content": video_info['title']}}]},
-                "URL": {"url": video_info['url']},
-                "Channel": {"multi_select": [{"name": video_info['channel']}]},
-            },
-            children=[
-                {"object": "block", "type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": "要約"}}]}},
-                {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": summary}}]}},
-                {"object": "block", "type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": "字幕"}}]}},
-                {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": video_info['caption']}}]}},
-            ]
+        writer = get_notion_writer(notion_token)
+        video_info["page_id"] = writer.save_page(
+            database_id,
+            page_properties(video_info),
+            page_blocks(summary, video_info['caption']),
         )
         print(f"[DEBUG] Notion page created for: {video_info['title']}")
+        return True
     except Exception as e:
         print(f"[ERROR] Exception in save_to_notion: {e}")
+        return False
+
+def process_videos(video_ids, youtube_api_key, gemini_api_key, notion_token, database_id, ledger=None, channels_by_video=None, stream=False, completed=None):
+    """
+    メタデータをまとめて取得した後、字幕取得・要約・Notion保存を
+    ステージごとのスレッドプールで並行処理する。
+    台帳(ledger)に同じ内容（タイトル・説明）で記録済みの動画は字幕取得より前にスキップする。
+    completedに集合を渡すと、台帳でスキップした動画、保存まで完了した動画、
+    やり直しても処理できない動画（PermanentSkip: 字幕トラックがない・要約がブロックされる）のIDを追加する。
+    channels_by_videoで動画ごとのチャンネル設定（字幕の言語・モデル）を渡せる。
+    stream=Trueのときは要約と保存を1つのステージにまとめ、要約を生成しながらNotionに書き込む。
+    保存まで完了した動画のvideo_infoのリストを返す。
+    """
+    ledger = ledger or NullLedger()
+    channels_by_video = channels_by_video or {}
+    completed = set() if completed is None else completed
+    video_ids = list(dict.fromkeys(video_ids))
+    infos = get_video_infos(video_ids, youtube_api_key, max_workers=METADATA_WORKERS)
+    video_infos = []
+    for video_id in video_ids:
+        if video_id not in infos:
+            print(f"[DEBUG] Skipping video_id={video_id} due to missing video info")
+            continue
+        title, description, channel = infos[video_id]
+        if ledger.contains(video_id, content_hash(video_id, title, description)):
+            print(f"[DEBUG] Skipping video_id={video_id} already in ledger")
+            completed.add(video_id)
+            continue
+        print(f"[DEBUG] Processing video_id={video_id}: title={title}, channel={channel}")
+        options = channels_by_video.get(video_id, {})
+        video_infos.append({
+            "video_id": video_id,
+            "title": title,
+            "description": description,
+            "url": f"https://www.youtube.com/watch?v={video_id}",
+            "channel": channel,
+            "languages": options.get("languages", ["ja"]),
+            "model": options.get("model", GEMINI_MODEL),
+        })
+
+    def skip_permanently(video_info, error):
+        print(f"[DEBUG] Skipping video_id={video_info['video_id']} permanently: {error}")
+        completed.add(video_info["video_id"])
+        return None
+
+    def fetch_caption(video_info):
+        try:
+            caption = get_japanese_caption(video_info["video_id"], video_info["languages"])
+        except PermanentSkip as e:
+            return skip_permanently(video_info, e)
+        if not caption:
+            print(f"[DEBUG] Skipping video_id={video_info['video_id']} due to missing caption")
+            return None
+        video_info["caption"] = caption
+        return video_info
+
+    def summarize(video_info):
+        try:
+            summary = summarize_with_gemini(
+                gemini_api_key, video_info["caption"], video_info["title"], video_info["description"],
+                video_info["model"],
+            )
+        except PermanentSkip as e:
+            return skip_permanently(video_info, e)
+        if not summary:
+            print(f"[DEBUG] Skipping video_id={video_info['video_id']} due to failed summary")
+            return None
+        video_info["summary"] = summary
+        return video_info
+
+    def save(video_info):
+        if not save_to_notion(notion_token, database_id, video_info, video_info["summary"]):
+            return None
+        return record(video_info)
+
+    def summarize_and_save(video_info):
+        try:
+            summary = stream_summary_to_notion(
+                gemini_api_key, notion_token, database_id, video_info, video_info["model"],
+            )
+        except PermanentSkip as e:
+            return skip_permanently(video_info, e)
+        if not summary:
+            print(f"[DEBUG] Skipping video_id={video_info['video_id']} due to failed summary")
+            return None
+        video_info["summary"] = summary
+        return record(video_info)
+
+    def record(video_info):
+        record_saved_page(
+            ledger, notion_token, video_info["video_id"],
+            content_hash(video_info["video_id"], video_info["title"], video_info["description"]),
+            video_info.get("page_id"),
+        )
+        completed.add(video_info["video_id"])
+        return video_info
+
+    if stream:
+        stages = [
+            Stage("caption", fetch_caption, CAPTION_WORKERS),
+            Stage("summarize_and_save", summarize_and_save, SUMMARIZE_WORKERS),
+        ]
+    else:
+        stages = [
+            Stage("caption", fetch_caption, CAPTION_WORKERS),
+            Stage("summarize", summarize, SUMMARIZE_WORKERS),
+            Stage("save", save, SAVE_WORKERS),
+        ]
+    return run_pipeline(video_infos, stages)
 
 def lambda_handler(event, context):
     try:
@@ -140,34 +265,69 @@ def lambda_handler(event, context):
             print("[ERROR] YOUTUBE_API_KEY is not set.")
             return {"status": "error", "error": "YOUTUBE_API_KEY is not set."}
 
-        channel_ids = [
-            "UCagAVZFPcLh9UMDidIUfXKQ", # MBチャンネル
-            "UC67Wr_9pA4I0glIxDt_Cpyw", # 学長
-            "UCXjTiSGclQLVVU83GVrRM4w", # ホリエモン
-        ]
-        for channel_id in channel_ids:
-            video_ids = get_video_ids_from_channel(channel_id, youtube_api_key)
-            for video_id in video_ids:
-                print(f"[DEBUG] Processing video_id={video_id}")
-                title, description, channel = get_video_info(video_id, youtube_api_key)
-                if not title:
-                    print(f"[DEBUG] Skipping video_id={video_id} due to missing video info")
-                    continue
-                url = f"https://www.youtube.com/watch?v={video_id}"
-
-                caption = get_japanese_caption(video_id)
-                if not caption:
-                    print(f"[DEBUG] Skipping video_id={video_id} due to missing caption")
-                    continue
-
-                summary = summarize_with_gemini(gemini_api_key, caption, title, description)
-                video_info = {
-                    "title": title,
-                    "url": url,
-                    "channel": channel,
-                    "caption": caption,
-                }
-                save_to_notion(notion_token, database_id, video_info, summary)
+        try:
+            channels = load_channels(event.get("channels_file"))
+        except ChannelRegistryError as e:
+            print(f"[ERROR] Invalid channel registry: {e}")
+            return {"status": "error", "error": str(e)}
+
+        # コーディネーター: {"fanout": n} でチャンネルをn個のシャードに分けてワーカーを呼び出す
+        if event.get("fanout"):
+            try:
+                events = shard_events(event, channels, event["fanout"])
+            except ValueError as e:
+                return {"status": "error", "error": str(e)}
+            dispatch_shards(events, context)
+            return {"status": "dispatched", "shards": events}
+        # ワーカー: {"shard": i, "of": n} で自分のシャードのチャンネルだけを処理する
+        if "shard" in event:
+            try:
+                channels = select_shard(channels, event["shard"], event.get("of"))
+            except ValueError as e:
+                return {"status": "error", "error": str(e)}
+            print(f"[DEBUG] Shard {event['shard']}/{event['of']}: {len(channels)} channels")
+        backend = event.get("discovery")
+        watermarks = open_watermarks() if event.get("incremental", INCREMENTAL_POLLING) else None
+        if event.get("engine", SUMMARY_ENGINE) == "async":
+            import async_engine
+            async_engine.run(
+                channels, youtube_api_key, gemini_api_key, notion_token, database_id,
+                get_japanese_caption, backend=backend, ledger_backend=event.get("ledger"),
+                watermarks=watermarks,
+            )
+            if watermarks is not None:
+                watermarks.save()
+            return {"status": "done"}
+
+        with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+            video_id_lists = executor.map(
+                lambda channel: get_video_ids_from_channel(
+                    channel["id"], youtube_api_key, channel["max_videos"],
+                    backend=backend, watermarks=watermarks,
+                ),
+                channels,
+            )
+            channels_by_video = {}
+            for channel, ids in zip(channels, video_id_lists):
+                for video_id in ids:
+                    channels_by_video.setdefault(video_id, channel)
+            video_ids = list(channels_by_video)
+
+        ledger = open_ledger(event.get("ledger"))
+        try:
+            # 台帳に記録済みの動画、保存まで終わった動画、やり直しても処理できない動画だけを完了とし、
+            # その分だけウォーターマークを進める（一時的な失敗の動画は次回もう一度処理する）
+            completed = set()
+            processed = process_videos(
+                video_ids, youtube_api_key, gemini_api_key, notion_token, database_id, ledger,
+                channels_by_video, stream=event.get("stream", SUMMARY_STREAMING), completed=completed,
+            )
+        finally:
+            ledger.close()
+        print(f"[DEBUG] Processed {len(processed)}/{len(video_ids)} videos")
+        if watermarks is not None:
+            watermarks.advance_completed(completed)
+            watermarks.save()
 
         return {"status": "done"}
     except Exception as e:
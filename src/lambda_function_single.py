@@ -1,8 +1,17 @@
+import json
 import os
-import requests
-from notion_client import Client as NotionClient
-import google.generativeai as genai
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+from concurrent.futures import ThreadPoolExecutor
+from clients import GEMINI_MODEL, get_gemini_model
+from http_session import get_session
+from notion_blocks import page_blocks, page_properties
+from notion_writer import get_notion_writer, record_saved_page, stream_summary_to_notion
+from summarizer import SUMMARY_STREAMING, summarize_transcript
+from summary_cache import get_summary_cache, summary_cache_key
+from caption_fallback import fetch_transcript_api_segments
+from transcript_cache import open_transcript, store_transcript
+from youtube_api import get_video_infos
+from ledger import NullLedger, content_hash, open_ledger
+from skips import PermanentSkip
 
 # 追加: ローカル実行用
 try:
@@ -11,13 +20,16 @@ try:
 except ImportError:
     pass
 
+# 複数の動画をまとめて処理するときの同時実行数
+SINGLE_WORKERS = int(os.environ.get("SINGLE_WORKERS", "4"))
+
 def get_video_info(video_id, api_key):
     url = (
         "https://www.googleapis.com/youtube/v3/videos"
         f"?key={api_key}&id={video_id}&part=snippet"
     )
     try:
-        resp = requests.get(url)
+        resp = get_session().get(url)
         resp.raise_for_status()
         data = resp.json()
         items = data.get("items", [])
@@ -34,18 +46,28 @@ def get_video_info(video_id, api_key):
         print(f"[ERROR] Exception in get_video_info: {e}")
         return None, None, None
 
-def get_japanese_caption(video_id):
+def get_japanese_caption(video_id, languages=("ja",)):
+    # youtube_transcript_apiは字幕取得ステージで初めて読み込む（コールドスタート短縮のため）
+    from youtube_transcript_api import TranscriptsDisabled, NoTranscriptFound
     try:
         from youtube_transcript_api._errors import RequestBlocked, IPBlocked
     except ImportError:
         from youtube_transcript_api._errors import RequestBlocked
         IPBlocked = RequestBlocked  # ダミーで同じものを使う
+    cache_language = ",".join(languages)
+    # 字幕は文字列にせず、ディスク上のキャッシュへの参照（Transcript）として後段に渡す
+    transcript = open_transcript(video_id, cache_language)
+    if transcript is not None:
+        return transcript
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['ja'])
-        texts = [item['text'] for item in transcript]
-        print(f"[DEBUG] Number of caption lines: {len(texts)}")
-        return "\n".join(texts)
-    except (TranscriptsDisabled, NoTranscriptFound) as e:
+        # 手動ja → 自動ja → en → jaへの翻訳 の順に、一覧から最適な字幕を選ぶ
+        segments, source = fetch_transcript_api_segments(video_id, languages)
+        if not segments:
+            print(f"[DEBUG] No usable caption found for video_id={video_id}")
+            return None
+        print(f"[DEBUG] Number of caption lines: {len(segments)}")
+        return store_transcript(video_id, cache_language, segments, source=source)
+    except (TranscriptsDisabled, NoTranscriptFound, PermanentSkip) as e:
         print(f"[DEBUG] No Japanese caption found for video_id={video_id}: {e}")
         return None
     except (RequestBlocked, IPBlocked) as e:
@@ -55,48 +77,136 @@ def get_japanese_caption(video_id):
         print(f"[ERROR] Exception in get_japanese_caption: {e}")
         return None
 
-def summarize_with_gemini(api_key, caption, title, description):
+def summarize_with_gemini(api_key, caption, title, description, model_name=GEMINI_MODEL):
     print(f"[DEBUG] summarize_with_gemini: title={title}, description={description[:30]}... (truncated)")
     try:
-        genai.configure(api_key=api_key)
-        prompt = f"""以下のYouTube動画の内容を日本語で要約してください。
-
-動画タイトル: {title}
-動画説明: {description}
-
-字幕内容:
-{caption}
-
-"""
-        model = genai.GenerativeModel("gemini-pro")
-        response = model.generate_content(prompt)
+        cache = get_summary_cache()
+        cache_key = summary_cache_key(caption, title, description, model_name)
+        summary = cache.get(cache_key)
+        if summary:
+            print(f"[DEBUG] Summary cache hit: title={title}")
+            return summary
+        model = get_gemini_model(api_key, model_name)
+        summary = summarize_transcript(model, caption, title, description)
         print(f"[DEBUG] Gemini response received")
-        return response.text.strip() if hasattr(response, "text") else str(response)
+        cache.set(cache_key, summary)
+        return summary
     except Exception as e:
         print(f"[ERROR] Exception in summarize_with_gemini: {e}")
-        return "要約生成中にエラーが発生しました。"
+        return None
 
 def save_to_notion(notion_token, database_id, video_info, summary):
     print(f"[DEBUG] save_to_notion: title={video_info['title']}")
     try:
-        notion = NotionClient(auth=notion_token)
-        notion.pages.create(
-            parent={"database_id": database_id},
-            properties={
-                "Title": {"title": [{"text": {"content": video_info['title']}}]},
-                "URL": {"url": video_info['url']},
-                "Channel": {"multi_select": [{"name": video_info['channel']}]},
-            },
-            children=[
-                {"object": "block", "type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": "要約"}}]}},
-                {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": summary}}]}},
-                {"object": "block", "type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": "字幕"}}]}},
-                {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": video_info['caption']}}]}},
-            ]
+        writer = get_notion_writer(notion_token)
+        video_info["page_id"] = writer.save_page(
+            database_id,
+            page_properties(video_info),
+            page_blocks(summary, video_info['caption']),
         )
         print(f"[DEBUG] Notion page created for: {video_info['title']}")
+        return True
     except Exception as e:
         print(f"[ERROR] Exception in save_to_notion: {e}")
+        return False
+
+def load_video_ids(path):
+    """
+    1行に1つのvideo_idを書いたファイル、またはJSONL（"video_id"を持つオブジェクト）を読み込む。
+    """
+    video_ids = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                video_id = json.loads(line).get("video_id")
+                if video_id:
+                    video_ids.append(video_id)
+            else:
+                video_ids.append(line)
+    return video_ids
+
+def process_video(video_id, youtube_api_key, gemini_api_key, notion_token, database_id, info=None, stream=False, ledger=None):
+    """
+    1本の動画を要約してNotionに保存する。成功時はNone、失敗時はエラーメッセージを返す。
+    infoに取得済みの (title, description, channel) を渡すとメタデータの取得を省略する。
+    stream=Trueのときは要約を生成しながらNotionに書き込む。
+    ledgerを渡すと、保存したページを台帳に記録する（以前のページがあればアーカイブする）。
+    """
+    print(f"[DEBUG] Processing video_id={video_id}")
+    title, description, channel = info or get_video_info(video_id, youtube_api_key)
+    if not title:
+        print(f"[DEBUG] Skipping video_id={video_id} due to missing video info")
+        return "No video info found."
+    url = f"https://www.youtube.com/watch?v={video_id}"
+
+    caption = get_japanese_caption(video_id)
+    if not caption:
+        print(f"[DEBUG] Skipping video_id={video_id} due to missing caption")
+        return "No Japanese caption found."
+
+    video_info = {
+        "title": title,
+        "description": description,
+        "url": url,
+        "channel": channel,
+        "caption": caption,
+    }
+    if stream:
+        try:
+            summary = stream_summary_to_notion(gemini_api_key, notion_token, database_id, video_info)
+        except PermanentSkip as e:
+            print(f"[DEBUG] Summary blocked for video_id={video_id}: {e}")
+            summary = None
+        if not summary:
+            print(f"[DEBUG] Skipping video_id={video_id} due to failed summary")
+            return "Failed to generate summary."
+    else:
+        summary = summarize_with_gemini(gemini_api_key, caption, title, description)
+        if not summary:
+            print(f"[DEBUG] Skipping video_id={video_id} due to failed summary")
+            return "Failed to generate summary."
+        if not save_to_notion(notion_token, database_id, video_info, summary):
+            return "Failed to save to Notion."
+    if ledger:
+        record_saved_page(
+            ledger, notion_token, video_id, content_hash(video_id, title, description), video_info.get("page_id"),
+        )
+    return None
+
+def process_videos(video_ids, youtube_api_key, gemini_api_key, notion_token, database_id, stream=False, ledger=None):
+    """
+    複数の動画を並行して処理し、video_id -> {"status", "error"} のdictを返す。
+    メタデータは50件ずつまとめて取得する。
+    台帳(ledger)に同じ内容で記録済みの動画は字幕取得より前にスキップし（status: "skipped"）、
+    保存まで完了した動画は台帳に記録する。
+    """
+    ledger = ledger or NullLedger()
+    video_ids = list(dict.fromkeys(video_ids))
+    infos = get_video_infos(video_ids, youtube_api_key)
+
+    def run(video_id):
+        title, description, channel = infos.get(video_id, (None, None, None))
+        digest = content_hash(video_id, title, description)
+        if title and ledger.contains(video_id, digest):
+            print(f"[DEBUG] Skipping video_id={video_id} already in ledger")
+            return {"status": "skipped"}
+        try:
+            error = process_video(
+                video_id, youtube_api_key, gemini_api_key, notion_token, database_id,
+                (title, description, channel), stream, ledger,
+            )
+        except Exception as e:
+            print(f"[ERROR] Exception while processing video_id={video_id}: {e}")
+            error = str(e)
+        if error:
+            return {"status": "error", "error": error}
+        return {"status": "done"}
+
+    with ThreadPoolExecutor(max_workers=max(1, SINGLE_WORKERS)) as executor:
+        return dict(zip(video_ids, executor.map(run, video_ids)))
 
 def lambda_handler(event, context):
     try:
@@ -119,33 +229,35 @@ def lambda_handler(event, context):
             print("[ERROR] YOUTUBE_API_KEY is not set.")
             return {"status": "error", "error": "YOUTUBE_API_KEY is not set."}
 
+        stream = event.get("stream", SUMMARY_STREAMING)
+        # 複数動画: video_ids（リスト）または video_ids_file（1行1件のファイル / JSONL）
+        video_ids = list(event.get("video_ids") or [])
+        if event.get("video_ids_file"):
+            video_ids.extend(load_video_ids(event["video_ids_file"]))
+        if video_ids:
+            ledger = open_ledger(event.get("ledger"))
+            try:
+                results = process_videos(
+                    video_ids, youtube_api_key, gemini_api_key, notion_token, database_id, stream, ledger,
+                )
+            finally:
+                ledger.close()
+            done = sum(1 for result in results.values() if result["status"] == "done")
+            skipped = sum(1 for result in results.values() if result["status"] == "skipped")
+            print(f"[DEBUG] Processed {done}/{len(results)} videos ({skipped} already in ledger)")
+            return {"status": "done", "results": results}
+
         # event から video_id を取得
         video_id = event.get("video_id")
         if not video_id:
             print("[ERROR] video_id is not provided in event.")
             return {"status": "error", "error": "video_id is not provided in event."}
 
-        print(f"[DEBUG] Processing video_id={video_id}")
-        title, description, channel = get_video_info(video_id, youtube_api_key)
-        if not title:
-            print(f"[DEBUG] Skipping video_id={video_id} due to missing video info")
-            return {"status": "error", "error": "No video info found."}
-        url = f"https://www.youtube.com/watch?v={video_id}"
-
-        caption = get_japanese_caption(video_id)
-        if not caption:
-            print(f"[DEBUG] Skipping video_id={video_id} due to missing caption")
-            return {"status": "error", "error": "No Japanese caption found."}
-
-        summary = summarize_with_gemini(gemini_api_key, caption, title, description)
-        video_info = {
-            "title": title,
-            "url": url,
-            "channel": channel,
-            "caption": caption,
-        }
-        save_to_notion(notion_token, database_id, video_info, summary)
-
+        error = process_video(
+            video_id, youtube_api_key, gemini_api_key, notion_token, database_id, stream=stream,
+        )
+        if error:
+            return {"status": "error", "error": error}
         return {"status": "done"}
     except Exception as e:
         print(f"[ERROR] Exception in lambda_handler: {e}")
@@ -155,10 +267,18 @@ def lambda_handler(event, context):
 def main():
     import sys
     if len(sys.argv) < 2:
-        print("Usage: python lambda_function_single.py <video_id>")
+        print("Usage: python lambda_function_single.py <video_id | video_ids_file> [...]")
         return
-    video_id = sys.argv[1]
-    lambda_handler({"video_id": video_id}, {})
+    video_ids = []
+    for arg in sys.argv[1:]:
+        if os.path.isfile(arg):
+            video_ids.extend(load_video_ids(arg))
+        else:
+            video_ids.append(arg)
+    if len(video_ids) == 1:
+        print(lambda_handler({"video_id": video_ids[0]}, {}))
+    else:
+        print(json.dumps(lambda_handler({"video_ids": video_ids}, {}), ensure_ascii=False, indent=2))
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,10 +1,20 @@
 import os
-import requests
-import xml.etree.ElementTree as ET
-from notion_client import Client as NotionClient
-import google.generativeai as genai
-import time
-import yt_dlp
+from clients import GEMINI_MODEL, get_gemini_model
+from http_session import get_session
+from notion_blocks import page_blocks, page_properties
+from notion_writer import get_notion_writer, record_saved_page
+from summarizer import summarize_transcript
+from summary_cache import get_summary_cache, summary_cache_key
+from caption_fallback import caption_chain, fetch_best, rank_captions
+from caption_parser import parse_captions, pick_format
+from transcript_cache import SpooledTranscript, open_transcript, spool_transcript
+from channels import ChannelRegistryError, load_channels
+from sharding import dispatch_shards, select_shard, shard_events
+from youtube_api import discover_new_videos, discover_video_ids, get_video_infos
+from ytdlp_pool import extract_caption_tracks
+from watermarks import INCREMENTAL_POLLING, open_watermarks
+from ledger import content_hash, open_ledger
+from skips import PermanentSkip
 
 # 追加: ローカル実行用
 try:
@@ -13,24 +23,22 @@ try:
 except ImportError:
     pass
 
-def get_video_ids_from_channel(channel_id, api_key, max_results=3):
-    url = (
-        "https://www.googleapis.com/youtube/v3/search"
-        f"?key={api_key}&channelId={channel_id}&part=snippet,id&order=date&maxResults={max_results}"
-    )
+# "sync"（逐次処理）または "async"（asyncioエンジン）
+SUMMARY_ENGINE = os.environ.get("SUMMARY_ENGINE", "sync")
+
+def get_video_ids_from_channel(channel_id, api_key, max_results=3, backend=None, watermarks=None):
+    # backend: "search" / "playlist" / "rss"（未指定ならDISCOVERY_BACKEND）
+    # watermarksを渡すと前回以降に公開された動画だけを（3件を超えても）すべて返す
+    if watermarks is None:
+        return discover_video_ids(channel_id, api_key, max_results, backend)
+    # 探索に失敗したチャンネルはtrackせず、ウォーターマークを進めない
     try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        data = resp.json()
-        video_ids = [
-            item["id"]["videoId"]
-            for item in data.get("items", [])
-            if item["id"]["kind"] == "youtube#video"
-        ]
-        return video_ids
+        videos = discover_new_videos(channel_id, api_key, watermarks.get(channel_id), max_results, backend)
     except Exception as e:
         print(f"[ERROR] Exception in get_video_ids_from_channel: {e}")
         return []
+    watermarks.track(channel_id, videos)
+    return [video["video_id"] for video in videos]
 
 def get_video_info(video_id, api_key):
     url = (
@@ -38,7 +46,7 @@ def get_video_info(video_id, api_key):
         f"?key={api_key}&id={video_id}&part=snippet"
     )
     try:
-        resp = requests.get(url)
+        resp = get_session().get(url)
         resp.raise_for_status()
         data = resp.json()
         items = data.get("items", [])
@@ -55,84 +63,92 @@ def get_video_info(video_id, api_key):
         print(f"[ERROR] Exception in get_video_info: {e}")
         return None, None, None
 
-def get_japanese_caption(video_id):
+def get_japanese_caption(video_id, languages=("ja",)):
     """
-    yt-dlpを使ってYouTube動画の日本語字幕を取得する。
+    yt-dlpを使ってYouTube動画の字幕を取得する。languagesの手動字幕・自動字幕を優先し、
+    なければフォールバック言語、最後に翻訳字幕を使う（caption_fallback.caption_chain）。
     """
     url = f"https://www.youtube.com/watch?v={video_id}"
-    ydl_opts = {
-        'skip_download': True,
-        'writesubtitles': True,
-        'subtitleslangs': ['ja'],
-        'subtitlesformat': 'vtt',
-        'quiet': True,
-        'forcejson': True,
-    }
+    cache_language = ",".join(languages)
+    # 字幕は文字列にせず、ディスク上のキャッシュへの参照（Transcript）として後段に渡す
+    transcript = open_transcript(video_id, cache_language)
+    if transcript is not None:
+        return transcript
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            subtitles = info.get('subtitles') or info.get('automatic_captions')
-            if not subtitles or 'ja' not in subtitles:
-                print(f"[DEBUG] No Japanese subtitles found for video_id={video_id}")
-                return None
-            # 字幕のURL取得
-            sub_url = subtitles['ja'][0]['url']
-            resp = requests.get(sub_url)
-            resp.raise_for_status()
-            # vtt形式をテキストに変換
-            lines = []
-            for line in resp.text.splitlines():
-                if line.strip() and not line.startswith(('WEBVTT', 'X-TIMESTAMP', 'NOTE')) and not line[0].isdigit():
-                    lines.append(line)
-            caption = '\n'.join(lines)
-            print(f"[DEBUG] Number of caption lines: {len(lines)}")
-            return caption
+        # 字幕トラックの一覧だけを（プールのYoutubeDLで）取得する
+        tracks = extract_caption_tracks(url)
+        # 一覧は1回だけ取得し、手動ja → 自動ja → en → jaへの翻訳 の順に最適な字幕を選ぶ
+        manual = tracks['subtitles']
+        auto = tracks['automatic_captions']
+        candidates = rank_captions(caption_chain(languages), manual, auto, list(manual.values()))
+        if not candidates:
+            # 字幕トラックがない動画は何度取得し直しても同じなので、完了扱いにしてウォーターマークを進める
+            raise PermanentSkip(f"no caption track for video_id={video_id}")
+
+        def fetch(kind, lang, formats):
+            # 字幕のURL取得（json3 → srv3 → vtt の順に軽い形式を選ぶ）
+            fmt = pick_format(formats)
+            if fmt is None:
+                raise ValueError(f"no supported caption format in {[f.get('ext') for f in formats]}")
+            sub_url = fmt['url']
+            if kind == "translate":
+                sub_url += f"&tlang={lang}"
+            with get_session().get(sub_url, stream=True) as resp:
+                resp.raise_for_status()
+                resp.encoding = "utf-8"
+                # 行ごとに読みながらタイミング付きのセグメントに変換し、ロールアップの重複を除いて
+                # そのままキャッシュの一時ファイルに書き出す（セグメントのリストは作らない）
+                segments = parse_captions(resp.iter_lines(decode_unicode=True), fmt['ext'])
+                return spool_transcript(video_id, cache_language, segments, source=f"yt-dlp:{kind}:{lang}")
+
+        best = fetch_best(candidates, fetch, discard=SpooledTranscript.discard)
+        if best is None:
+            print(f"[DEBUG] No usable subtitles found for video_id={video_id}")
+            return None
+        kind, language, spooled = best
+        print(f"[DEBUG] Using {kind} subtitles ({language}) for video_id={video_id}")
+        print(f"[DEBUG] Number of caption lines: {len(spooled)}")
+        return spooled.commit()
+    except PermanentSkip:
+        raise
     except Exception as e:
         print(f"[ERROR] Exception in get_japanese_caption (yt-dlp): {e}")
         return None
 
-def summarize_with_gemini(api_key, caption, title, description):
+def summarize_with_gemini(api_key, caption, title, description, model_name=GEMINI_MODEL):
     print(f"[DEBUG] summarize_with_gemini: title={title}, description={description[:30]}... (truncated)")
     try:
-        genai.configure(api_key=api_key)
-        prompt = f"""以下のYouTube動画の内容を日本語で要約してください。
-
-動画タイトル: {title}
-動画説明: {description}
-
-字幕内容:
-{caption}
-
-"""
-        model = genai.GenerativeModel("gemini-pro")
-        response = model.generate_content(prompt)
+        cache = get_summary_cache()
+        cache_key = summary_cache_key(caption, title, description, model_name)
+        summary = cache.get(cache_key)
+        if summary:
+            print(f"[DEBUG] Summary cache hit: title={title}")
+            return summary
+        model = get_gemini_model(api_key, model_name)
+        summary = summarize_transcript(model, caption, title, description)
         print(f"[DEBUG] Gemini response received")
-        return response.text.strip() if hasattr(response, "text") else str(response)
+        cache.set(cache_key, summary)
+        return summary
+    except PermanentSkip:
+        raise
     except Exception as e:
         print(f"[ERROR] Exception in summarize_with_gemini: {e}")
-        return "要約生成中にエラーが発生しました。"
+        return None
 
 def save_to_notion(notion_token, database_id, video_info, summary):
     print(f"[DEBUG] save_to_notion: title={video_info['title']}")
     try:
-        notion = NotionClient(auth=notion_token)
-        notion.pages.create(
-            parent={"database_id": database_id},
-            properties={
-                "Title": {"title": [{"text": {"content": video_info['title']}}]},
-                "URL": {"url": video_info['url']},
-                "Channel": {"multi_select": [{"name": video_info['channel']}]},
-            },
-            children=[
-                {"object": "block", "type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": "要約"}}]}},
-                {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": summary}}]}},
-                {"object": "block", "type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": "字幕"}}]}},
-                {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": video_info['caption']}}]}},
-            ]
+        writer = get_notion_writer(notion_token)
+        video_info["page_id"] = writer.save_page(
+            database_id,
+            page_properties(video_info),
+            page_blocks(summary, video_info['caption']),
         )
         print(f"[DEBUG] Notion page created for: {video_info['title']}")
+        return True
     except Exception as e:
         print(f"[ERROR] Exception in save_to_notion: {e}")
+        return False
 
 def lambda_handler(event, context):
     try:
@@ -141,34 +157,100 @@ def lambda_handler(event, context):
         gemini_api_key = os.environ["GEMINI_API_KEY"]
         youtube_api_key = os.environ["YOUTUBE_API_KEY"]
 
-        channel_ids = [
-            "UCagAVZFPcLh9UMDidIUfXKQ", # MBチャンネル
-            "UC67Wr_9pA4I0glIxDt_Cpyw", # 学長
-            "UCXjTiSGclQLVVU83GVrRM4w", # ホリエモン
-        ]
-        for channel_id in channel_ids:
-            video_ids = get_video_ids_from_channel(channel_id, youtube_api_key)
+        try:
+            channels = load_channels(event.get("channels_file"))
+        except ChannelRegistryError as e:
+            print(f"[ERROR] Invalid channel registry: {e}")
+            return {"status": "error", "error": str(e)}
+
+        # コーディネーター: {"fanout": n} でチャンネルをn個のシャードに分けてワーカーを呼び出す
+        if event.get("fanout"):
+            try:
+                events = shard_events(event, channels, event["fanout"])
+            except ValueError as e:
+                return {"status": "error", "error": str(e)}
+            dispatch_shards(events, context)
+            return {"status": "dispatched", "shards": events}
+        # ワーカー: {"shard": i, "of": n} で自分のシャードのチャンネルだけを処理する
+        if "shard" in event:
+            try:
+                channels = select_shard(channels, event["shard"], event.get("of"))
+            except ValueError as e:
+                return {"status": "error", "error": str(e)}
+            print(f"[DEBUG] Shard {event['shard']}/{event['of']}: {len(channels)} channels")
+        backend = event.get("discovery")
+        watermarks = open_watermarks() if event.get("incremental", INCREMENTAL_POLLING) else None
+        if event.get("engine", SUMMARY_ENGINE) == "async":
+            import async_engine
+            async_engine.run(
+                channels, youtube_api_key, gemini_api_key, notion_token, database_id,
+                get_japanese_caption, backend=backend, ledger_backend=event.get("ledger"),
+                watermarks=watermarks,
+            )
+            if watermarks is not None:
+                watermarks.save()
+            return {"status": "done"}
+
+        ledger = open_ledger(event.get("ledger"))
+        try:
+            channels_by_video = {}
+            for channel in channels:
+                for video_id in get_video_ids_from_channel(
+                    channel["id"], youtube_api_key, channel["max_videos"],
+                    backend=backend, watermarks=watermarks,
+                ):
+                    channels_by_video.setdefault(video_id, channel)
+            # 台帳に記録済みの動画、保存まで終わった動画、やり直しても処理できない動画だけを完了とし、
+            # その分だけウォーターマークを進める（一時的な失敗の動画は次回もう一度処理する）
+            completed = set()
+            video_ids = list(channels_by_video)
+            infos = get_video_infos(video_ids, youtube_api_key)
+
             for video_id in video_ids:
                 print(f"[DEBUG] Processing video_id={video_id}")
-                title, description, channel = get_video_info(video_id, youtube_api_key)
-                if not title:
+                if video_id not in infos:
                     print(f"[DEBUG] Skipping video_id={video_id} due to missing video info")
                     continue
+                title, description, channel = infos[video_id]
+                if ledger.contains(video_id, content_hash(video_id, title, description)):
+                    print(f"[DEBUG] Skipping video_id={video_id} already in ledger")
+                    completed.add(video_id)
+                    continue
                 url = f"https://www.youtube.com/watch?v={video_id}"
 
-                caption = get_japanese_caption(video_id)
-                if not caption:
-                    print(f"[DEBUG] Skipping video_id={video_id} due to missing caption")
+                options = channels_by_video[video_id]
+                try:
+                    caption = get_japanese_caption(video_id, options["languages"])
+                    if not caption:
+                        print(f"[DEBUG] Skipping video_id={video_id} due to missing caption")
+                        continue
+                    summary = summarize_with_gemini(
+                        gemini_api_key, caption, title, description, options["model"]
+                    )
+                except PermanentSkip as e:
+                    print(f"[DEBUG] Skipping video_id={video_id} permanently: {e}")
+                    completed.add(video_id)
+                    continue
+                if not summary:
+                    print(f"[DEBUG] Skipping video_id={video_id} due to failed summary")
                     continue
-
-                summary = summarize_with_gemini(gemini_api_key, caption, title, description)
                 video_info = {
                     "title": title,
                     "url": url,
                     "channel": channel,
                     "caption": caption,
                 }
-                save_to_notion(notion_token, database_id, video_info, summary)
+                if save_to_notion(notion_token, database_id, video_info, summary):
+                    record_saved_page(
+                        ledger, notion_token, video_id, content_hash(video_id, title, description),
+                        video_info.get("page_id"),
+                    )
+                    completed.add(video_id)
+        finally:
+            ledger.close()
+        if watermarks is not None:
+            watermarks.advance_completed(completed)
+            watermarks.save()
 
         return {"status": "done"}
     except Exception as e:
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from s3_state import s3_hooks
+
+# 処理済み動画の台帳
+#   "sqlite" : ローカル実行用のSQLiteファイル
+#   "json"   : Lambdaの/tmpに置くJSONファイル（export/importフックで外部に退避可能）
+#   "none"   : 台帳を使わない
+LEDGER_BACKEND = os.environ.get(
+    "LEDGER_BACKEND", "json" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "sqlite"
+)
+LEDGER_PATH = os.environ.get("LEDGER_PATH")
+# JSON台帳の退避先（"s3://bucket/key"）。起動時に読み込み、終了時にS3上の最新の内容とマージして書き戻す。
+# 指定しなければ/tmpの台帳はコールドスタートで失われ、その後の実行では処理済みの動画も再処理される
+LEDGER_S3_URI = os.environ.get("LEDGER_S3_URI")
+
+def content_hash(video_id, title="", description=""):
+    """
+    動画の内容を識別するハッシュ。タイトルや説明が変わった場合は別の値になる。
+    変わった動画は要約し直し、台帳に記録したNotionのページ（page_id）を新しいページで置き換える。
+    """
+    data = "\0".join([video_id, title or "", description or ""])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+class NullLedger:
+    def contains(self, video_id, digest=None):
+        return False
+
+    def record(self, video_id, digest, page_id=None):
+        pass
+
+    def page_id(self, video_id):
+        return None
+
+    def close(self):
+        pass
+
+class SqliteLedger:
+    def __init__(self, path="processed_videos.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_videos ("
+            " video_id TEXT PRIMARY KEY,"
+            " content_hash TEXT NOT NULL,"
+            " processed_at REAL NOT NULL,"
+            " page_id TEXT)"
+        )
+        # page_id列がない以前の台帳には列を足す（既存の行はNULLのまま）
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(processed_videos)")}
+        if "page_id" not in columns:
+            self.conn.execute("ALTER TABLE processed_videos ADD COLUMN page_id TEXT")
+        self.conn.commit()
+
+    def contains(self, video_id, digest=None):
+        """
+        記録済みならTrueを返す。digestを渡すと、記録時と内容（content_hash）が同じときだけTrueにする。
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT content_hash FROM processed_videos WHERE video_id = ?", (video_id,)
+            ).fetchone()
+        return row is not None and (digest is None or row[0] == digest)
+
+    def record(self, video_id, digest, page_id=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO processed_videos (video_id, content_hash, processed_at, page_id)"
+                " VALUES (?, ?, ?, ?)",
+                (video_id, digest, time.time(), page_id),
+            )
+            self.conn.commit()
+
+    def page_id(self, video_id):
+        """
+        記録済みの動画のNotionのページIDを返す（未記録、またはページIDなしで記録した場合はNone）。
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT page_id FROM processed_videos WHERE video_id = ?", (video_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class JsonLedger:
+    """
+    JSONファイルに保存する台帳。
+    import_hook() が返したdictを起動時に取り込み、close時に export_hook(dict) を呼ぶ。
+    S3などに台帳を退避してコールドスタートをまたいで引き継ぐ用途を想定している。
+    """
+
+    def __init__(self, path="/tmp/processed_videos.json", import_hook=None, export_hook=None):
+        self.path = path
+        self.export_hook = export_hook
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if import_hook:
+            self.import_state(import_hook() or {})
+
+    def import_state(self, entries):
+        with self.lock:
+            self.entries = merge_entries(self.entries, entries)
+
+    def export_state(self):
+        with self.lock:
+            return dict(self.entries)
+
+    def contains(self, video_id, digest=None):
+        with self.lock:
+            entry = self.entries.get(video_id)
+        return entry is not None and (digest is None or entry.get("content_hash") == digest)
+
+    def record(self, video_id, digest, page_id=None):
+        with self.lock:
+            self.entries[video_id] = {"content_hash": digest, "processed_at": time.time(), "page_id": page_id}
+            self._write()
+
+    def page_id(self, video_id):
+        with self.lock:
+            entry = self.entries.get(video_id)
+        return entry.get("page_id") if entry else None
+
+    def _write(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[ERROR] Failed to write ledger {self.path}: {e}")
+
+    def close(self):
+        if self.export_hook:
+            try:
+                self.export_hook(self.export_state())
+            except Exception as e:
+                print(f"[ERROR] Exception in ledger export hook: {e}")
+
+def merge_entries(current, entries):
+    """
+    2つの台帳の内容を合わせる。同じ動画が両方にあれば、後から記録した方を残す。
+    """
+    merged = dict(current)
+    for video_id, entry in entries.items():
+        existing = merged.get(video_id)
+        if existing is None or existing.get("processed_at", 0) <= entry.get("processed_at", 0):
+            merged[video_id] = entry
+    return merged
+
+def open_ledger(backend=None, path=None, **kwargs):
+    backend = backend or LEDGER_BACKEND
+    path = path or LEDGER_PATH
+    if backend == "none":
+        return NullLedger()
+    if backend == "sqlite":
+        return SqliteLedger(path or "processed_videos.db")
+    if backend == "json":
+        if LEDGER_S3_URI and "import_hook" not in kwargs and "export_hook" not in kwargs:
+            kwargs["import_hook"], kwargs["export_hook"] = s3_hooks(LEDGER_S3_URI, merge=merge_entries)
+        return JsonLedger(path or "/tmp/processed_videos.json", **kwargs)
+    raise ValueError(f"Unknown ledger backend: {backend}")
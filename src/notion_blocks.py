@@ -0,0 +1,213 @@
+import asyncio
+import itertools
+import json
+from transcript_cache import transcript_lines
+
+# Notion APIの制限: rich_textの1要素は2000文字まで、1リクエストの子ブロックは100個まで
+NOTION_TEXT_LIMIT = 2000
+NOTION_CHILDREN_LIMIT = 100
+# リクエストボディは500KBまで。プロパティなどの分の余裕を残して子ブロックは合計400KBまでにする
+NOTION_PAYLOAD_LIMIT = 400 * 1024
+
+def _text_length(text):
+    # NotionはUTF-16のコードユニット数で数えるので、BMP外の文字は2文字扱いにする
+    return len(text) + sum(1 for ch in text if ord(ch) > 0xFFFF)
+
+def _lines_with_ends(text):
+    if isinstance(text, str):
+        return text.splitlines(keepends=True)
+    return (line + "\n" for line in transcript_lines(text))
+
+def iter_text_pieces(text, limit=NOTION_TEXT_LIMIT):
+    """
+    textをlimit文字以下の断片に分割して順にyieldする。なるべく改行の位置で区切る。
+    textは文字列のほか、Transcriptやセグメントのリストでもよい（1行ずつ読みながら分割する）。
+    """
+    current = ""
+    for line in _lines_with_ends(text or ""):
+        if _text_length(current) + _text_length(line) <= limit:
+            current += line
+            continue
+        if current.strip():
+            yield current.rstrip("\n")
+        current = ""
+        while _text_length(line) > limit:
+            cut = limit
+            while _text_length(line[:cut]) > limit:
+                cut -= 1
+            if line[:cut].strip():
+                yield line[:cut].rstrip("\n")
+            line = line[cut:]
+        current = line
+    if current.strip():
+        yield current.rstrip("\n")
+
+def heading_block(text):
+    return {"object": "block", "type": "heading_2", "heading_2": {"rich_text": [{"type": "text", "text": {"content": text}}]}}
+
+def paragraph_blocks(text):
+    for piece in iter_text_pieces(text):
+        yield {"object": "block", "type": "paragraph", "paragraph": {"rich_text": [{"type": "text", "text": {"content": piece}}]}}
+
+def page_blocks(summary, caption):
+    """
+    要約と字幕のページ本文をブロックのジェネレータとして返す。
+    """
+    yield heading_block("要約")
+    yield from paragraph_blocks(summary)
+    yield heading_block("字幕")
+    yield from paragraph_blocks(caption)
+
+def streamed_paragraph_blocks(text_chunks):
+    """
+    ストリーミングで届くテキストの断片から、改行で段落が確定するたびにその段落ブロックのリストをyieldする。
+    """
+    buffer = ""
+    for text in text_chunks:
+        buffer += text
+        end = buffer.rfind("\n")
+        if end < 0:
+            continue
+        ready, buffer = buffer[:end + 1], buffer[end + 1:]
+        blocks = list(paragraph_blocks(ready))
+        if blocks:
+            yield blocks
+    blocks = list(paragraph_blocks(buffer))
+    if blocks:
+        yield blocks
+
+def streaming_page_batches(summary_chunks, caption):
+    """
+    page_blocks のストリーミング版。ページ本文を、届いた順に追記するブロックのリストとして返す。
+    """
+    yield [heading_block("要約")]
+    yield from streamed_paragraph_blocks(summary_chunks)
+    # 字幕のブロックはリストにせずジェネレータのまま渡し、100個ずつ組み立てながら追記する
+    yield itertools.chain([heading_block("字幕")], paragraph_blocks(caption))
+
+def _block_bytes(block):
+    # 送信時のJSONのUTF-8バイト数（日本語は1文字3バイトになる）
+    return len(json.dumps(block, ensure_ascii=False).encode("utf-8"))
+
+def chunk_blocks(blocks, size=NOTION_CHILDREN_LIMIT, max_bytes=NOTION_PAYLOAD_LIMIT):
+    """
+    ブロックを、size個以下かつJSONにして合計max_bytes以下のリストに分けて順に返す。
+    """
+    chunk = []
+    chunk_bytes = 0
+    for block in blocks:
+        block_bytes = _block_bytes(block)
+        if chunk and (len(chunk) == size or chunk_bytes + block_bytes > max_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(block)
+        chunk_bytes += block_bytes
+    if chunk:
+        yield chunk
+
+def page_properties(video_info):
+    return {
+        "Title": {"title": [{"text": {"content": video_info['title']}}]},
+        "URL": {"url": video_info['url']},
+        "Channel": {"multi_select": [{"name": video_info['channel']}]},
+    }
+
+def _call(fn, **kwargs):
+    return fn(**kwargs)
+
+async def _call_async(fn, **kwargs):
+    return await fn(**kwargs)
+
+def _archive_partial_page(notion, page_id, request):
+    try:
+        request(notion.pages.update, page_id=page_id, archived=True)
+    except Exception as e:
+        print(f"[ERROR] Failed to archive partial page {page_id}: {e}")
+
+async def _archive_partial_page_async(notion, page_id, request):
+    try:
+        await request(notion.pages.update, page_id=page_id, archived=True)
+    except Exception as e:
+        print(f"[ERROR] Failed to archive partial page {page_id}: {e}")
+
+def create_page(notion, database_id, properties, blocks, request=_call):
+    """
+    最初のチャンク（100ブロック・400KBまで）でページを作成し、残りはblocks.children.appendで順に追加する。
+    追加は順序を保つため1ページ内では逐次で行い、次のチャンクは送信の直前に組み立てる。
+    requestを渡すと各API呼び出しをそれ経由で行う（レート制限やリトライ用）。
+    追加に失敗した場合は書きかけのページをアーカイブしてから例外を送出する。
+    作成したページのIDを返す。
+    """
+    chunks = chunk_blocks(blocks)
+    page = request(
+        notion.pages.create,
+        parent={"database_id": database_id},
+        properties=properties,
+        children=next(chunks, []),
+    )
+    appended = 0
+    try:
+        for chunk in chunks:
+            request(notion.blocks.children.append, block_id=page["id"], children=chunk)
+            appended += 1
+    except Exception:
+        _archive_partial_page(notion, page["id"], request)
+        raise
+    if appended:
+        print(f"[DEBUG] Appended {appended} block batch(es) to page {page['id']}")
+    return page["id"]
+
+async def create_page_async(notion, database_id, properties, blocks, request=_call_async):
+    """
+    create_page の非同期版（notion_client.AsyncClient用）。
+    各チャンクの組み立て（字幕ファイルの読み込みとJSONでのサイズ計算）はスレッドで行い、イベントループを止めない。
+    """
+    chunks = chunk_blocks(blocks)
+    page = await request(
+        notion.pages.create,
+        parent={"database_id": database_id},
+        properties=properties,
+        children=await asyncio.to_thread(next, chunks, []),
+    )
+    appended = 0
+    try:
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            await request(notion.blocks.children.append, block_id=page["id"], children=chunk)
+            appended += 1
+    except Exception:
+        await _archive_partial_page_async(notion, page["id"], request)
+        raise
+    if appended:
+        print(f"[DEBUG] Appended {appended} block batch(es) to page {page['id']}")
+    return page["id"]
+
+def create_streaming_page(notion, database_id, properties, block_batches, request=_call):
+    """
+    最初のブロックのリストでページをすぐに作成し、以降はリストが届くたびにblocks.children.appendで追記する。
+    途中で失敗した場合は書きかけのページをアーカイブしてから例外を送出する（再実行時に重複させないため）。
+    作成したページのIDを返す。
+    """
+    batches = iter(block_batches)
+    first = next(batches, [])
+    chunks = chunk_blocks(first)
+    page = request(
+        notion.pages.create,
+        parent={"database_id": database_id},
+        properties=properties,
+        children=next(chunks, []),
+    )
+    appended = 0
+    try:
+        for chunk in chunks:
+            request(notion.blocks.children.append, block_id=page["id"], children=chunk)
+            appended += 1
+        for batch in batches:
+            for chunk in chunk_blocks(batch):
+                request(notion.blocks.children.append, block_id=page["id"], children=chunk)
+                appended += 1
+    except Exception:
+        _archive_partial_page(notion, page["id"], request)
+        raise
+    print(f"[DEBUG] Streamed {appended} block batch(es) to page {page['id']}")
+    return page["id"]
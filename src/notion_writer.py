@@ -0,0 +1,262 @@
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from clients import GEMINI_MODEL, get_gemini_model, get_notion_client
+from notion_blocks import create_page, create_streaming_page, page_blocks, page_properties, streaming_page_batches
+from skips import PermanentSkip
+from summarizer import summarize_transcript_stream
+from summary_cache import get_summary_cache, summary_cache_key
+
+# Notionの制限はインテグレーションあたり平均3リクエスト/秒
+NOTION_RATE_PER_SECOND = float(os.environ.get("NOTION_RATE_PER_SECOND", "3"))
+NOTION_BURST = int(os.environ.get("NOTION_BURST", "3"))
+NOTION_MAX_RETRIES = int(os.environ.get("NOTION_MAX_RETRIES", "6"))
+# 書き込み待ちキューの上限と書き込みスレッド数
+NOTION_QUEUE_SIZE = int(os.environ.get("NOTION_QUEUE_SIZE", "32"))
+NOTION_WRITER_WORKERS = int(os.environ.get("NOTION_WRITER_WORKERS", "3"))
+
+# ここで送るのはページの作成・ブロックの追記などの冪等でない書き込みなので、429だけをリトライする。
+# 429はリクエストが処理される前に拒否されるが、5xxは書き込みが反映済みの場合があり、リトライするとブロックが重複する
+RETRYABLE_STATUSES = (429,)
+
+_limiters = {}
+_writers = {}
+_lock = threading.Lock()
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット。rate個/秒で補充され、最大capacity個までためられる。
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        トークンを1つ予約し、使えるようになるまでの待ち時間（秒）を返す。
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def pause(self, seconds):
+        """
+        Retry-Afterを受け取ったときなど、バケット全体をseconds秒止める。
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def get_rate_limiter(notion_token):
+    """
+    トークン（インテグレーション）ごとに1つのTokenBucketを共有する。
+    """
+    with _lock:
+        limiter = _limiters.get(notion_token)
+        if limiter is None:
+            limiter = TokenBucket(NOTION_RATE_PER_SECOND, NOTION_BURST)
+            _limiters[notion_token] = limiter
+        return limiter
+
+def retry_delay(error, attempt):
+    """
+    リトライ可能なエラーなら待ち時間（秒）を返し、そうでなければNoneを返す。
+    Retry-Afterヘッダがあればそれに従い、なければジッター付きの指数バックオフにする。
+    """
+    from notion_client.errors import HTTPResponseError
+    if not isinstance(error, HTTPResponseError) or error.status not in RETRYABLE_STATUSES:
+        return None
+    retry_after = error.headers.get("Retry-After") if error.headers else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+def call_with_retry(limiter, fn, max_retries=NOTION_MAX_RETRIES, **kwargs):
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return fn(**kwargs)
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt == max_retries:
+                raise
+            print(f"[DEBUG] Notion request failed ({e}), retrying in {delay:.1f}s")
+            if e.status == 429:
+                limiter.pause(delay)
+            time.sleep(delay)
+
+async def call_with_retry_async(limiter, fn, max_retries=NOTION_MAX_RETRIES, **kwargs):
+    """
+    call_with_retry の非同期版（notion_client.AsyncClient用）。
+    """
+    for attempt in range(max_retries + 1):
+        await limiter.acquire_async()
+        try:
+            return await fn(**kwargs)
+        except Exception as e:
+            delay = retry_delay(e, attempt)
+            if delay is None or attempt == max_retries:
+                raise
+            print(f"[DEBUG] Notion request failed ({e}), retrying in {delay:.1f}s")
+            if e.status == 429:
+                limiter.pause(delay)
+            await asyncio.sleep(delay)
+
+class NotionWriter:
+    """
+    レート制限付きでNotionに書き込むライター。
+    submitされた書き込みは上限付きキューに積まれ、書き込みスレッドが順に処理する。
+    キューが一杯のときsubmitはブロックするので、上流のステージが自然に待たされる。
+    """
+
+    def __init__(self, notion, limiter, queue_size=NOTION_QUEUE_SIZE, workers=NOTION_WRITER_WORKERS):
+        self.notion = notion
+        self.limiter = limiter
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"notion-writer-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _worker(self):
+        while True:
+            future, fn, args, kwargs = self.queue.get()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except Exception as e:
+                        future.set_exception(e)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self.queue.put((future, fn, args, kwargs))
+        return future
+
+    def request(self, fn, **kwargs):
+        return call_with_retry(self.limiter, fn, **kwargs)
+
+    def create_page(self, database_id, properties, blocks):
+        return create_page(self.notion, database_id, properties, blocks, request=self.request)
+
+    def stream_page(self, database_id, properties, block_batches):
+        """
+        ストリーミング中の要約を書き込む。生成が終わるまで書き込みスレッドを占有しないよう、
+        キューを通さず呼び出し元のスレッドで実行する（レート制限は共有する）。
+        """
+        return create_streaming_page(self.notion, database_id, properties, block_batches, request=self.request)
+
+    def archive_page(self, page_id):
+        return self.request(self.notion.pages.update, page_id=page_id, archived=True)
+
+    def save_page(self, database_id, properties, blocks):
+        """
+        ページ作成をキューに積み、完了まで待ってページIDを返す。
+        """
+        return self.submit(self.create_page, database_id, properties, blocks).result()
+
+def get_notion_writer(notion_token):
+    """
+    トークンごとに1つのNotionWriterを共有する（ウォームスタート間でも再利用される）。
+    """
+    limiter = get_rate_limiter(notion_token)
+    with _lock:
+        writer = _writers.get(notion_token)
+        if writer is None:
+            writer = NotionWriter(get_notion_client(notion_token), limiter)
+            _writers[notion_token] = writer
+        return writer
+
+def record_saved_page(ledger, notion_token, video_id, digest, page_id):
+    """
+    保存したページを台帳に記録する。タイトルや説明が変わって作り直した動画は、台帳にある以前のページをアーカイブする。
+    アーカイブに失敗しても新しいページは保存済みなので、ログに出すだけにする。
+    """
+    previous = ledger.page_id(video_id)
+    ledger.record(video_id, digest, page_id)
+    if not previous or previous == page_id:
+        return
+    try:
+        get_notion_writer(notion_token).archive_page(previous)
+        print(f"[DEBUG] Archived replaced page {previous} for video_id={video_id}")
+    except Exception as e:
+        print(f"[ERROR] Failed to archive replaced page {previous}: {e}")
+
+def stream_summary_to_notion(api_key, notion_token, database_id, video_info, model_name=GEMINI_MODEL):
+    """
+    要約をストリーミングで生成しながら、届いた段落から順にNotionのページへ書き込む。
+    要約がキャッシュにあれば通常どおり保存する。成功したら要約の全文、失敗したらNoneを返す。
+    作成したページのIDはvideo_info["page_id"]に入れる。
+    要約が空だった場合も失敗として扱い、書きかけのページはアーカイブされる。
+    要約がブロックされた場合（PermanentSkip）は、書きかけのページをアーカイブしてから送出する。
+    """
+    caption, title, description = video_info['caption'], video_info['title'], video_info['description']
+    print(f"[DEBUG] stream_summary_to_notion: title={title}")
+    writer = get_notion_writer(notion_token)
+    cache = get_summary_cache()
+    cache_key = summary_cache_key(caption, title, description, model_name)
+    summary = cache.get(cache_key)
+    if summary:
+        print(f"[DEBUG] Summary cache hit: title={title}")
+        try:
+            video_info["page_id"] = writer.save_page(database_id, page_properties(video_info), page_blocks(summary, caption))
+        except Exception as e:
+            print(f"[ERROR] Exception in stream_summary_to_notion: {e}")
+            return None
+        return summary
+
+    pieces = []
+
+    def summary_chunks():
+        for text in summarize_transcript_stream(model, caption, title, description):
+            pieces.append(text)
+            yield text
+        # 例外にしてページの書き込みを中断させる（create_streaming_pageがページをアーカイブする）
+        if not "".join(pieces).strip():
+            raise ValueError("Gemini returned an empty summary")
+
+    try:
+        model = get_gemini_model(api_key, model_name)
+        video_info["page_id"] = writer.stream_page(
+            database_id,
+            page_properties(video_info),
+            streaming_page_batches(summary_chunks(), caption),
+        )
+    except PermanentSkip:
+        raise
+    except Exception as e:
+        print(f"[ERROR] Exception in stream_summary_to_notion: {e}")
+        return None
+    summary = "".join(pieces).strip()
+    print(f"[DEBUG] Notion page streamed for: {title}")
+    cache.set(cache_key, summary)
+    return summary
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Stage:
+    """
+    パイプラインの1ステージ。funcは1件を受け取り、次のステージへ渡す値を返す。
+    Noneを返した場合はその件をスキップしてパイプラインから外す。
+    """
+
+    def __init__(self, name, func, workers):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+
+def run_pipeline(items, stages):
+    """
+    ステージごとに専用のスレッドプールを持つパイプラインでitemsを処理する。
+    各ステージの同時実行数はStage.workersで制限され、
+    全体の所要時間は全ステージの合計ではなく最も遅いステージで決まる。
+    最終ステージまで到達した結果のリストを返す（順不同）。
+    """
+    items = list(items)
+    if not items or not stages:
+        return items
+
+    executors = [
+        ThreadPoolExecutor(max_workers=stage.workers, thread_name_prefix=stage.name)
+        for stage in stages
+    ]
+    results = []
+    lock = threading.Lock()
+    finished = threading.Condition(lock)
+    pending = [len(items)]
+
+    def done_one(result=None):
+        with finished:
+            if result is not None:
+                results.append(result)
+            pending[0] -= 1
+            if pending[0] == 0:
+                finished.notify_all()
+
+    def submit(index, item):
+        future = executors[index].submit(stages[index].func, item)
+        future.add_done_callback(lambda f: on_done(index, f))
+
+    def on_done(index, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"[ERROR] Exception in pipeline stage {stages[index].name}: {e}")
+            result = None
+        if result is None:
+            done_one()
+        elif index + 1 < len(stages):
+            submit(index + 1, result)
+        else:
+            done_one(result)
+
+    try:
+        for item in items:
+            submit(0, item)
+        with finished:
+            while pending[0] > 0:
+                finished.wait()
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+    return results
@@ -0,0 +1,55 @@
+import json
+import random
+import time
+
+# 同じオブジェクトへの書き込みが競合したときに読み直してやり直す回数
+S3_WRITE_ATTEMPTS = 5
+# 条件付き書き込みが競合したときのS3のエラーコード
+CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+
+def parse_s3_uri(uri):
+    bucket, _, key = uri[len("s3://"):].partition("/")
+    if not uri.startswith("s3://") or not bucket or not key:
+        raise ValueError(f"Invalid S3 URI: {uri}")
+    return bucket, key
+
+def s3_hooks(uri, merge=None):
+    """
+    "s3://bucket/key" のJSONに状態を退避する (import_hook, export_hook) を返す。
+    mergeを渡すと、export時にS3上の現在の内容を読み直して merge(current, state) を書き込む。
+    書き込みは読んだときのETagを条件にする（PutObjectのIfMatch/IfNoneMatch。botocore 1.35.x以降が必要）ので、
+    ファンアウトした複数のシャードが同時に書き戻しても、他のシャードの内容を上書きで消さない。
+    """
+    bucket, key = parse_s3_uri(uri)
+
+    def read(client):
+        try:
+            obj = client.get_object(Bucket=bucket, Key=key)
+        except client.exceptions.NoSuchKey:
+            return {}, None
+        return json.loads(obj["Body"].read()), obj["ETag"]
+
+    def import_hook():
+        import boto3
+        return read(boto3.client("s3"))[0]
+
+    def export_hook(state):
+        import boto3
+        from botocore.exceptions import ClientError
+        client = boto3.client("s3")
+        for attempt in range(S3_WRITE_ATTEMPTS):
+            current, etag = read(client)
+            body = json.dumps(merge(current, state) if merge else state).encode("utf-8")
+            condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+            try:
+                client.put_object(Bucket=bucket, Key=key, Body=body, **condition)
+                return
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in CONFLICT_CODES:
+                    raise
+            delay = 0.2 * 2 ** attempt * (0.5 + random.random())
+            print(f"[DEBUG] Concurrent write to {uri}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+        raise RuntimeError(f"Gave up writing {uri} after {S3_WRITE_ATTEMPTS} conflicting attempts")
+
+    return import_hook, export_hook
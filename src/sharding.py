@@ -0,0 +1,81 @@
+import bisect
+import hashlib
+import json
+import os
+
+# シャード分割時に各シャードへ割り当てる仮想ノード数（多いほど偏りが小さい）
+SHARD_VIRTUAL_NODES = int(os.environ.get("SHARD_VIRTUAL_NODES", "64"))
+# ワーカーとして呼び出すLambda関数名（未設定なら自分自身）
+SHARD_FUNCTION_NAME = os.environ.get("SHARD_FUNCTION_NAME")
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+def build_ring(shard_count, virtual_nodes=None):
+    """
+    コンシステントハッシュのリング（ハッシュ値の昇順に並んだ (hash, shard) のリスト）を作る。
+    シャード数を変えても、ほとんどのチャンネルは同じシャードに割り当てられたままになる。
+    """
+    virtual_nodes = virtual_nodes or SHARD_VIRTUAL_NODES
+    return sorted(
+        (_hash(f"shard-{shard}-{node}"), shard)
+        for shard in range(shard_count)
+        for node in range(virtual_nodes)
+    )
+
+def shard_for(channel_id, ring):
+    hashes = [point for point, _ in ring]
+    index = bisect.bisect(hashes, _hash(channel_id)) % len(ring)
+    return ring[index][1]
+
+def partition_channels(channels, shard_count):
+    """
+    チャンネルのリストをshard_count個のシャードに分ける（各シャード内の優先度順は保つ）。
+    """
+    if not isinstance(shard_count, int) or shard_count < 1:
+        raise ValueError(f"shard count must be a positive integer: {shard_count!r}")
+    ring = build_ring(shard_count)
+    shards = [[] for _ in range(shard_count)]
+    for channel in channels:
+        shards[shard_for(channel["id"], ring)].append(channel)
+    return shards
+
+def select_shard(channels, shard, shard_count):
+    """
+    ワーカーモード: {"shard": i, "of": n} のi番目のシャードのチャンネルだけを返す。
+    """
+    if not isinstance(shard, int) or not 0 <= shard < (shard_count or 0):
+        raise ValueError(f"shard must be in [0, {shard_count}): {shard!r}")
+    return partition_channels(channels, shard_count)[shard]
+
+def shard_events(event, channels, shard_count):
+    """
+    コーディネーターモード: 元のイベントからfanoutを除き、シャードごとのイベントを作る。
+    チャンネルが1つも割り当てられないシャードのイベントは作らない。
+    """
+    base = {key: value for key, value in event.items() if key != "fanout"}
+    return [
+        dict(base, shard=shard, of=shard_count)
+        for shard, members in enumerate(partition_channels(channels, shard_count))
+        if members
+    ]
+
+def dispatch_shards(events, context=None):
+    """
+    シャードごとのイベントでワーカーのLambdaを非同期に呼び出す。
+    関数名が分からない（ローカル実行）場合は呼び出さずにイベントだけ返す。
+    """
+    function_name = SHARD_FUNCTION_NAME or getattr(context, "function_name", None)
+    if not function_name:
+        print(f"[DEBUG] No worker function configured; returning {len(events)} shard events")
+        return events
+    import boto3
+    client = boto3.client("lambda")
+    for shard_event in events:
+        client.invoke(
+            FunctionName=function_name,
+            InvocationType="Event",
+            Payload=json.dumps(shard_event).encode("utf-8"),
+        )
+        print(f"[DEBUG] Dispatched shard {shard_event['shard']}/{shard_event['of']} to {function_name}")
+    return events
@@ -0,0 +1,5 @@
+class PermanentSkip(Exception):
+    """
+    やり直しても結果が変わらない理由で動画を処理できなかったことを表す（字幕トラックがない、要約が安全性フィルタでブロックされるなど）。
+    この動画は完了として扱い、ウォーターマークを止めない。ネットワークエラーやIPブロックなどの一時的な失敗には使わない。
+    """
@@ -0,0 +1,235 @@
+import asyncio
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from gemini_scheduler import GEMINI_OUTPUT_TOKENS, get_gemini_scheduler
+from skips import PermanentSkip
+
+# 要約モード
+#   "auto"       : 字幕がチャンク上限を超えたときだけmap-reduceにする
+#   "single"     : 常に1回のプロンプトで要約する
+#   "map_reduce" : 常にチャンクごとに要約してから統合する
+SUMMARY_MODE = os.environ.get("SUMMARY_MODE", "auto")
+# 1チャンクあたりの推定トークン数の上限
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", "8000"))
+# mapフェーズの同時実行数
+SUMMARY_MAP_WORKERS = int(os.environ.get("SUMMARY_MAP_WORKERS", "4"))
+# "1"にすると要約をストリーミングで受け取り、届いた段落から順にNotionへ書き込む
+SUMMARY_STREAMING = os.environ.get("SUMMARY_STREAMING", "0") == "1"
+
+# 同じプロンプトならやり直してもブロックされる終了理由（finish_reason）
+BLOCKED_FINISH_REASONS = ("SAFETY", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII")
+
+# 文の区切り（句点・感嘆符・疑問符・改行）
+SENTENCE_END = re.compile(r"(?<=[。．！？!?\n])")
+
+def estimate_tokens(text):
+    """
+    トークン数の概算。ASCIIは約4文字で1トークン、日本語などは1文字1トークンとみなす。
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+def split_sentences(text):
+    return [sentence for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+def split_transcript(text, max_tokens=None):
+    """
+    字幕を文の境界でmax_tokens以下のチャンクに分割する。
+    1文だけで上限を超える場合は文の途中で切る。
+    """
+    max_tokens = max_tokens or SUMMARY_CHUNK_TOKENS
+    chunks = []
+    current = []
+    current_tokens = 0
+    for sentence in split_sentences(text):
+        tokens = estimate_tokens(sentence)
+        if tokens > max_tokens:
+            if current:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            step = max(1, len(sentence) * max_tokens // tokens)
+            chunks.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+            continue
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+def build_prompt(caption, title, description):
+    return f"""以下のYouTube動画の内容を日本語で要約してください。
+
+動画タイトル: {title}
+動画説明: {description}
+
+字幕内容:
+{caption}
+
+"""
+
+def build_map_prompt(chunk, title, index, total):
+    return f"""以下はYouTube動画「{title}」の字幕の一部（{index}/{total}）です。
+この部分の内容を、後で全体の要約に統合できるよう日本語で箇条書きに要約してください。
+
+字幕内容:
+{chunk}
+
+"""
+
+def build_reduce_prompt(partial_summaries, title, description):
+    joined = "\n\n".join(
+        f"[パート{i}]\n{summary}" for i, summary in enumerate(partial_summaries, 1)
+    )
+    return f"""以下はYouTube動画の字幕をパートごとに要約したものです。
+これらを統合して、動画全体の内容を日本語で要約してください。
+
+動画タイトル: {title}
+動画説明: {description}
+
+パートごとの要約:
+{joined}
+
+"""
+
+def check_blocked(response):
+    """
+    プロンプトまたは応答が安全性フィルタなどでブロックされていればPermanentSkipを送出する。
+    """
+    feedback = getattr(response, "prompt_feedback", None)
+    if feedback is not None and feedback.block_reason:
+        raise PermanentSkip(f"Gemini blocked the prompt ({feedback.block_reason.name})")
+    for candidate in getattr(response, "candidates", None) or ():
+        if candidate.finish_reason.name in BLOCKED_FINISH_REASONS:
+            raise PermanentSkip(f"Gemini blocked the response ({candidate.finish_reason.name})")
+
+def response_text(response):
+    check_blocked(response)
+    return response.text.strip() if hasattr(response, "text") else str(response)
+
+def generate(model, prompt):
+    """
+    RPM/TPMの予算内でGeminiを呼び出し、応答テキストを返す。
+    """
+    scheduler = get_gemini_scheduler(getattr(model, "model_name", ""))
+    tokens = estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS
+    return response_text(scheduler.generate(model, prompt, tokens))
+
+def generate_stream(model, prompt):
+    """
+    generate と同じくRPM/TPMの予算内でGeminiを呼び出し、応答テキストを届いた断片ごとにyieldする。
+    """
+    scheduler = get_gemini_scheduler(getattr(model, "model_name", ""))
+    tokens = estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS
+    for chunk in scheduler.generate(model, prompt, tokens, stream=True):
+        text = chunk_text(chunk)
+        if text:
+            yield text
+
+def chunk_text(chunk):
+    """
+    ストリーミング応答の1チャンクのテキスト。partsを持たないチャンク（finish_reasonだけのチャンクなど）では
+    chunk.textがValueErrorを送出するので、候補のpartsから直接読む。
+    """
+    candidates = getattr(chunk, "candidates", None)
+    if candidates is None:
+        return getattr(chunk, "text", "")
+    check_blocked(chunk)
+    if not candidates:
+        return ""
+    parts = getattr(candidates[0].content, "parts", None) or []
+    return "".join(getattr(part, "text", "") for part in parts)
+
+async def generate_async(model, prompt):
+    scheduler = get_gemini_scheduler(getattr(model, "model_name", ""))
+    tokens = estimate_tokens(prompt) + GEMINI_OUTPUT_TOKENS
+    return response_text(await scheduler.generate_async(model, prompt, tokens))
+
+def use_map_reduce(caption, mode=None, chunk_tokens=None):
+    mode = mode or SUMMARY_MODE
+    if mode == "single":
+        return False
+    if mode == "map_reduce":
+        return True
+    return estimate_tokens(caption) > (chunk_tokens or SUMMARY_CHUNK_TOKENS)
+
+def compact(caption):
+    # compactionはsummarizerのestimate_tokensを使うので、循環importにならないよう呼び出し時に読み込む
+    from compaction import compact_transcript
+    return compact_transcript(caption)
+
+def summarize_transcript(model, caption, title, description, mode=None, chunk_tokens=None, workers=None):
+    """
+    字幕を要約する。字幕はまず圧縮（フィラー・重複の除去）し、
+    長い字幕はチャンクごとに並行して要約(map)した後、統合(reduce)する。
+    """
+    caption = compact(caption)
+    if not use_map_reduce(caption, mode, chunk_tokens):
+        return generate(model, build_prompt(caption, title, description))
+
+    partial_summaries = map_summaries(model, caption, title, chunk_tokens, workers)
+    if len(partial_summaries) == 1:
+        return partial_summaries[0]
+    return generate(model, build_reduce_prompt(partial_summaries, title, description))
+
+def map_prompts(caption, title, chunk_tokens=None):
+    chunks = split_transcript(caption, chunk_tokens)
+    print(f"[DEBUG] Map-reduce summarization: {len(chunks)} chunks")
+    return [build_map_prompt(chunk, title, i, len(chunks)) for i, chunk in enumerate(chunks, 1)]
+
+def map_summaries(model, caption, title, chunk_tokens=None, workers=None):
+    """
+    mapフェーズ: 字幕をチャンクに分け、チャンクごとの要約を並行して作る。
+    """
+    prompts = map_prompts(caption, title, chunk_tokens)
+    with ThreadPoolExecutor(max_workers=max(1, workers or SUMMARY_MAP_WORKERS)) as executor:
+        return list(executor.map(lambda prompt: generate(model, prompt), prompts))
+
+def summarize_transcript_stream(model, caption, title, description, mode=None, chunk_tokens=None, workers=None):
+    """
+    summarize_transcript のストリーミング版。最終的な要約のテキストを断片ごとにyieldする。
+    map-reduceの場合、mapフェーズは通常どおり行い、reduceの応答だけをストリーミングする。
+    """
+    caption = compact(caption)
+    if not use_map_reduce(caption, mode, chunk_tokens):
+        yield from generate_stream(model, build_prompt(caption, title, description))
+        return
+
+    partial_summaries = map_summaries(model, caption, title, chunk_tokens, workers)
+    if len(partial_summaries) == 1:
+        yield partial_summaries[0]
+        return
+    yield from generate_stream(model, build_reduce_prompt(partial_summaries, title, description))
+
+def _prepare_prompts(caption, title, description, mode=None, chunk_tokens=None):
+    """
+    字幕を圧縮し、1回で要約するプロンプトとmapフェーズのプロンプトのリストのどちらか一方を返す（もう一方はNone）。
+    """
+    caption = compact(caption)
+    if not use_map_reduce(caption, mode, chunk_tokens):
+        return build_prompt(caption, title, description), None
+    return None, map_prompts(caption, title, chunk_tokens)
+
+async def summarize_transcript_async(model, caption, title, description, mode=None, chunk_tokens=None, workers=None):
+    """
+    summarize_transcript の非同期版。
+    字幕の読み込み・圧縮・プロンプトの組み立ては長い字幕では数秒かかるので、スレッドで行ってイベントループを止めない。
+    """
+    prompt, prompts = await asyncio.to_thread(_prepare_prompts, caption, title, description, mode, chunk_tokens)
+    if prompts is None:
+        return await generate_async(model, prompt)
+
+    semaphore = asyncio.Semaphore(max(1, workers or SUMMARY_MAP_WORKERS))
+
+    async def summarize_chunk(prompt):
+        async with semaphore:
+            return await generate_async(model, prompt)
+
+    partial_summaries = await asyncio.gather(*(summarize_chunk(prompt) for prompt in prompts))
+    if len(partial_summaries) == 1:
+        return partial_summaries[0]
+    return await generate_async(model, build_reduce_prompt(partial_summaries, title, description))
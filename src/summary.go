@@ -18,6 +18,7 @@ import (
     "github.com/google/generative-ai-go/genai"
     "encoding/xml"
     "os/exec"
+    _ "embed"
 )
 
 const (
@@ -115,12 +116,53 @@ func downloadJapaneseSubtitle(videoID string) error {
     return nil
 }
 
+// ビルド時に埋め込むチャンネル一覧（Lambdaのzipにはbootstrapしか入らないため）
+//go:embed channels.json
+var embeddedChannels []byte
+
+// チャンネル一覧ファイル（Python版と共通のchannels.json）
+type ChannelRegistry struct {
+    Channels []struct {
+        ID string `json:"id"`
+    } `json:"channels"`
+}
+
+// チャンネルIDのリストを読み込む
+// pathが空ならビルド時に埋め込んだchannels.jsonを使う
+func loadChannelIDs(path string) ([]string, error) {
+    data := embeddedChannels
+    source := "embedded channels.json"
+    if path != "" {
+        var err error
+        data, err = os.ReadFile(path)
+        if err != nil {
+            return nil, err
+        }
+        source = path
+    }
+    return parseChannelIDs(data, source)
+}
+
+func parseChannelIDs(data []byte, source string) ([]string, error) {
+    var registry ChannelRegistry
+    if err := json.Unmarshal(data, &registry); err != nil {
+        return nil, err
+    }
+    ids := make([]string, 0, len(registry.Channels))
+    for _, channel := range registry.Channels {
+        if channel.ID == "" {
+            return nil, fmt.Errorf("channel id is empty in %s", source)
+        }
+        ids = append(ids, channel.ID)
+    }
+    return ids, nil
+}
+
 func main() {
-    // チャンネルIDのリスト
-    channelIDs := []string{
-        "UCagAVZFPcLh9UMDidIUfXKQ", // MBチャンネル
-        "UC67Wr_9pA4I0glIxDt_Cpyw", // 学長
-        "UCXjTiSGclQLVVU83GVrRM4w", // ホリエモン
+    // チャンネルIDのリスト（CHANNELS_FILEを指定しなければ埋め込みの一覧）
+    channelIDs, err := loadChannelIDs(os.Getenv("CHANNELS_FILE"))
+    if err != nil {
+        log.Fatalf("チャンネル一覧の読み込み失敗: %v", err)
     }
     for _, channelID := range channelIDs {
         videoID, err := getLatestVideoIDFromRSS(channelID)
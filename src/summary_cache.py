@@ -0,0 +1,227 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from compaction import compaction_fingerprint
+from summarizer import build_map_prompt, build_prompt, build_reduce_prompt
+from transcript_cache import transcript_lines
+
+# 要約キャッシュ
+#   "memory"    : プロセス内のLRU（ウォームスタート間で共有）
+#   "sqlite"    : ローカル実行用のSQLiteファイル
+#   "directory" : 1件1ファイルで保存するディレクトリ（Lambdaでは/tmp）
+#   "none"      : キャッシュしない
+SUMMARY_CACHE_BACKEND = os.environ.get(
+    "SUMMARY_CACHE_BACKEND", "directory" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "sqlite"
+)
+SUMMARY_CACHE_PATH = os.environ.get("SUMMARY_CACHE_PATH")
+# 有効期限（秒）と最大件数
+SUMMARY_CACHE_TTL = float(os.environ.get("SUMMARY_CACHE_TTL", str(30 * 24 * 3600)))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.environ.get("SUMMARY_CACHE_MAX_ENTRIES", "1000"))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def prompt_fingerprint():
+    """
+    プロンプトテンプレートのハッシュ。テンプレートを変更するとキャッシュは自動的に無効になる。
+    """
+    templates = [
+        build_prompt("{caption}", "{title}", "{description}"),
+        build_map_prompt("{chunk}", "{title}", 0, 0),
+        build_reduce_prompt(["{summary}"], "{title}", "{description}"),
+    ]
+    return hashlib.sha256("\0".join(templates).encode("utf-8")).hexdigest()
+
+def summary_cache_key(caption, title, description, model_name):
+    """
+    captionは文字列のほか、Transcriptやセグメントのリストでもよい（行ごとに読みながらハッシュする）。
+    """
+    digest = hashlib.sha256()
+    for part in (prompt_fingerprint(), compaction_fingerprint(), model_name, title or "", description or ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    for i, line in enumerate(transcript_lines(caption)):
+        digest.update((f"\n{line}" if i else line).encode("utf-8"))
+    digest.update(b"\0")
+    return digest.hexdigest()
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+class MemoryCache:
+    def __init__(self, ttl=SUMMARY_CACHE_TTL, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.time() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+class SqliteCache:
+    def __init__(self, path="summary_cache.db", ttl=SUMMARY_CACHE_TTL, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " key TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT summary, stored_at FROM summaries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM summaries WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE summaries SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?)", (key, value, now, now)
+            )
+            self.conn.execute("DELETE FROM summaries WHERE stored_at < ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM summaries WHERE key NOT IN"
+                " (SELECT key FROM summaries ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self.conn.commit()
+
+class DirectoryCache:
+    """
+    1件を1ファイル（<key>.txt）として保存する。
+    TTLは1行目に書いた保存時刻で判定し（他のバックエンドと同じく保存からの経過時間）、
+    件数上限は最終アクセス時刻（読むたびに更新するmtime）の新しいものから残す。
+    """
+
+    def __init__(self, path="/tmp/summary_cache", ttl=SUMMARY_CACHE_TTL, max_entries=SUMMARY_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.txt")
+
+    def _stored_at(self, f):
+        try:
+            return float(f.readline())
+        except ValueError:
+            # 保存時刻のない古い形式のファイルは期限切れとして扱う
+            return 0.0
+
+    def get(self, key):
+        file_path = self._file(key)
+        try:
+            with open(file_path, encoding="utf-8") as f:
+                expired = time.time() - self._stored_at(f) > self.ttl
+                value = None if expired else f.read()
+            if expired:
+                os.remove(file_path)
+                return None
+            os.utime(file_path)
+            return value
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        file_path = self._file(key)
+        tmp_path = f"{file_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(f"{time.time()}\n")
+                f.write(value)
+            os.replace(tmp_path, file_path)
+        except OSError as e:
+            print(f"[ERROR] Failed to write summary cache {file_path}: {e}")
+            return
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            now = time.time()
+            entries = []
+            for name in os.listdir(self.path):
+                if not name.endswith(".txt"):
+                    continue
+                file_path = os.path.join(self.path, name)
+                try:
+                    accessed_at = os.path.getmtime(file_path)
+                    with open(file_path, encoding="utf-8") as f:
+                        stored_at = self._stored_at(f)
+                    if now - stored_at > self.ttl:
+                        os.remove(file_path)
+                        continue
+                except OSError:
+                    continue
+                entries.append((accessed_at, file_path))
+            entries.sort(reverse=True)
+            for _, file_path in entries[self.max_entries:]:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+
+def open_summary_cache(backend=None, path=None):
+    backend = backend or SUMMARY_CACHE_BACKEND
+    path = path or SUMMARY_CACHE_PATH
+    if backend == "none":
+        return NullCache()
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "sqlite":
+        return SqliteCache(path or "summary_cache.db")
+    if backend == "directory":
+        return DirectoryCache(path or "/tmp/summary_cache")
+    raise ValueError(f"Unknown summary cache backend: {backend}")
+
+def get_summary_cache():
+    """
+    プロセス内で共有する要約キャッシュを返す。
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = open_summary_cache()
+    return _cache
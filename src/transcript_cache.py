@@ -0,0 +1,163 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+
+# 字幕キャッシュの保存先（Lambdaでは/tmp）
+TRANSCRIPT_CACHE_DIR = os.environ.get(
+    "TRANSCRIPT_CACHE_DIR",
+    "/tmp/transcript_cache" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "transcript_cache",
+)
+# キャッシュの形式のバージョン（字幕のパース方法を変えたときに上げ、古いキャッシュを読まないようにする）
+#   2: yt-dlpの字幕にもタイミングを付け、自動字幕の重複行を除くようにした
+#   3: 1行目にヘッダ、2行目以降に1セグメントずつ書くJSONLにした（全体を読み込まずに順に読めるように）
+TRANSCRIPT_CACHE_VERSION = 3
+
+# ファイル名に使えない文字
+UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+def _cache_file(video_id, language):
+    name = UNSAFE_CHARS.sub("_", f"{video_id}.{language}")
+    return os.path.join(TRANSCRIPT_CACHE_DIR, f"{name}.jsonl.gz")
+
+def _read_header(f):
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        return None
+    if not isinstance(header, dict) or header.get("version") != TRANSCRIPT_CACHE_VERSION:
+        return None
+    return header
+
+def has_transcript(video_id, language="ja"):
+    try:
+        with gzip.open(_cache_file(video_id, language), "rt", encoding="utf-8") as f:
+            return _read_header(f) is not None
+    except OSError:
+        return False
+
+def iter_transcript(video_id, language="ja"):
+    """
+    キャッシュ済みの字幕セグメント（{"text", "start", "duration"}）をファイルから1件ずつyieldする。
+    """
+    with gzip.open(_cache_file(video_id, language), "rt", encoding="utf-8") as f:
+        if _read_header(f) is None:
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class SpooledTranscript:
+    """
+    spool_transcriptで一時ファイルに書き出した字幕。commitするまではキャッシュとして見えない。
+    キャッシュに書き込めない環境では、セグメントのリストをメモリ上に持つ。
+    """
+
+    def __init__(self, video_id, language, path=None, segments=None, count=0):
+        self.video_id = video_id
+        self.language = language
+        self.path = path
+        self.segments = segments
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def commit(self):
+        """
+        一時ファイルをキャッシュとして確定し、その参照（Transcript）を返す。
+        メモリ上に持っている場合はセグメントのリストを返す。
+        """
+        if self.path is None:
+            return self.segments
+        os.replace(self.path, _cache_file(self.video_id, self.language))
+        self.path = None
+        return Transcript(self.video_id, self.language)
+
+    def discard(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+def spool_transcript(video_id, language, segments, source=""):
+    """
+    セグメントのイテラブルを、yieldされるそばからキャッシュ形式の一時ファイルに書き出す。
+    字幕全体をメモリに持たないので、パーサーのジェネレータをそのまま渡せる。
+    セグメントが1件もなければNoneを返す。
+    """
+    header = {
+        "version": TRANSCRIPT_CACHE_VERSION,
+        "video_id": video_id,
+        "language": language,
+        "source": source,
+    }
+    try:
+        os.makedirs(TRANSCRIPT_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=TRANSCRIPT_CACHE_DIR, suffix=".tmp")
+    except OSError as e:
+        # 読み取り専用の環境などではメモリ上に持つ
+        print(f"[ERROR] Failed to create transcript cache file in {TRANSCRIPT_CACHE_DIR}: {e}")
+        segments = list(segments)
+        return SpooledTranscript(video_id, language, segments=segments, count=len(segments)) if segments else None
+    spooled = SpooledTranscript(video_id, language, path=tmp_path)
+    try:
+        with gzip.open(os.fdopen(fd, "wb"), "wt", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for segment in segments:
+                f.write(json.dumps(segment, ensure_ascii=False) + "\n")
+                spooled.count += 1
+    except BaseException:
+        spooled.discard()
+        raise
+    if not spooled.count:
+        spooled.discard()
+        return None
+    return spooled
+
+class Transcript:
+    """
+    ディスク上の字幕キャッシュへの参照。iterするたびにファイルからセグメントを読み直すので、
+    動画の長さにかかわらず字幕全体をメモリに持たずに、要約・Notion保存の各ステージへ渡せる。
+    """
+
+    def __init__(self, video_id, language="ja"):
+        self.video_id = video_id
+        self.language = language
+
+    def __iter__(self):
+        return iter_transcript(self.video_id, self.language)
+
+    def __repr__(self):
+        return f"Transcript({self.video_id!r}, {self.language!r})"
+
+def open_transcript(video_id, language="ja"):
+    """
+    キャッシュ済みならその参照（Transcript）を返し、なければNoneを返す。
+    """
+    if not has_transcript(video_id, language):
+        return None
+    print(f"[DEBUG] Transcript cache hit: video_id={video_id}, language={language}")
+    return Transcript(video_id, language)
+
+def store_transcript(video_id, language, segments, source=""):
+    """
+    セグメントを1件ずつキャッシュに書き出し、その参照を返す。
+    書き込めなかった場合（読み取り専用の環境など）はメモリ上のセグメントのリストを返す。
+    セグメントが1件もなければNoneを返す。
+    """
+    spooled = spool_transcript(video_id, language, segments, source)
+    return spooled.commit() if spooled is not None else None
+
+def transcript_lines(caption):
+    """
+    字幕（文字列、またはTranscript・セグメントのリスト）を1行ずつのテキストとしてyieldする。
+    """
+    if isinstance(caption, str):
+        yield from caption.splitlines()
+        return
+    for segment in caption or ():
+        yield segment["text"]
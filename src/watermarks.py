@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from s3_state import s3_hooks
+
+# チャンネルごとの「前回までに見た最新動画」の保存先
+WATERMARK_PATH = os.environ.get(
+    "WATERMARK_PATH",
+    "/tmp/channel_watermarks.json" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "channel_watermarks.json",
+)
+# ウォーターマークの退避先（"s3://bucket/key"）。起動時に読み込み、保存時にS3上の最新の内容とマージして書き戻す。
+# Lambdaの/tmpはコールドスタートで失われるので、指定しなければその度に最新数件の取得からやり直しになる
+WATERMARK_S3_URI = os.environ.get("WATERMARK_S3_URI")
+# "0"にすると毎回最新3件を取得する従来の動作になる
+INCREMENTAL_POLLING = os.environ.get("INCREMENTAL_POLLING", "1") == "1"
+
+class WatermarkStore:
+    """
+    チャンネルID -> {"video_id", "published_at"} を保持するJSONファイル。
+    探索した動画はtrackで覚えておき、処理が終わった後にadvance_completedで完了した分だけ進める。
+    advanceはメモリ上だけ更新し、saveで書き出す（実行が最後まで終わったときだけ保存する想定）。
+    JsonLedgerと同じく、import_hook() が返したdictを起動時に取り込み、save時に export_hook(dict) を呼ぶ。
+    """
+
+    def __init__(self, path=WATERMARK_PATH, import_hook=None, export_hook=None):
+        self.path = path
+        self.export_hook = export_hook
+        self.lock = threading.Lock()
+        self.watermarks = {}
+        self.discovered = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.watermarks = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if import_hook:
+            self.import_state(import_hook() or {})
+
+    def import_state(self, watermarks):
+        with self.lock:
+            self.watermarks = merge_watermarks(self.watermarks, watermarks)
+
+    def export_state(self):
+        with self.lock:
+            return dict(self.watermarks)
+
+    def get(self, channel_id):
+        with self.lock:
+            return self.watermarks.get(channel_id)
+
+    def advance(self, channel_id, videos, completed=None):
+        """
+        videosを古い順にたどり、未完了の動画の直前までをそのチャンネルのウォーターマークにする。
+        completedは完了した（または意図的にスキップした）動画IDの集合で、Noneならすべて完了とみなす。
+        未完了の動画より新しい動画は、完了していても次回もう一度探索される（台帳でスキップされる）。
+        """
+        newest = None
+        for video in sorted(videos, key=lambda video: video.get("published_at") or ""):
+            if completed is not None and video["video_id"] not in completed:
+                break
+            newest = video
+        if newest is None:
+            return
+        with self.lock:
+            current = self.watermarks.get(channel_id)
+            if current and (current.get("published_at") or "") > (newest.get("published_at") or ""):
+                return
+            self.watermarks[channel_id] = {
+                "video_id": newest["video_id"],
+                "published_at": newest.get("published_at"),
+            }
+
+    def track(self, channel_id, videos):
+        """
+        探索に成功したチャンネルの動画を覚えておく（探索に失敗したチャンネルは呼ばない）。
+        """
+        with self.lock:
+            self.discovered[channel_id] = list(videos)
+
+    def advance_completed(self, completed):
+        """
+        trackした各チャンネルのウォーターマークを、completedに含まれる動画の分だけ進める。
+        """
+        with self.lock:
+            discovered, self.discovered = self.discovered, {}
+        for channel_id, videos in discovered.items():
+            self.advance(channel_id, videos, completed)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.watermarks, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"[ERROR] Failed to write watermarks {self.path}: {e}")
+        if self.export_hook:
+            try:
+                self.export_hook(self.export_state())
+            except Exception as e:
+                print(f"[ERROR] Exception in watermark export hook: {e}")
+
+def merge_watermarks(current, watermarks):
+    """
+    2つのウォーターマークを合わせる。同じチャンネルが両方にあれば、新しい動画を指す方を残す。
+    """
+    merged = dict(current)
+    for channel_id, watermark in watermarks.items():
+        existing = merged.get(channel_id)
+        if existing is None or (existing.get("published_at") or "") <= (watermark.get("published_at") or ""):
+            merged[channel_id] = watermark
+    return merged
+
+def open_watermarks(path=None, **kwargs):
+    if WATERMARK_S3_URI and "import_hook" not in kwargs and "export_hook" not in kwargs:
+        kwargs["import_hook"], kwargs["export_hook"] = s3_hooks(WATERMARK_S3_URI, merge=merge_watermarks)
+    return WatermarkStore(path or WATERMARK_PATH, **kwargs)
@@ -0,0 +1,302 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http_session import get_session
+
+YOUTUBE_API_BASE = "https://www.googleapis.com/youtube/v3"
+YOUTUBE_RSS_URL = "https://www.youtube.com/feeds/videos.xml"
+
+# 動画一覧の取得方法
+#   "search"   : search.list（100ユニット/回）
+#   "playlist" : アップロード再生リスト + playlistItems.list（1ユニット/回）
+#   "rss"      : feeds/videos.xml（クォータ消費なし、最新15件まで）
+DISCOVERY_BACKEND = os.environ.get("DISCOVERY_BACKEND", "playlist")
+# チャンネルID -> アップロード再生リストIDのキャッシュファイル（Lambdaでは/tmp）
+UPLOADS_PLAYLIST_CACHE = os.environ.get("UPLOADS_PLAYLIST_CACHE", "/tmp/uploads_playlists.json")
+
+# 前回以降に公開された動画をたどる上限件数
+WATERMARK_MAX_BACKLOG = int(os.environ.get("WATERMARK_MAX_BACKLOG", "200"))
+
+RSS_NAMESPACES = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+_uploads_playlists = None
+_uploads_playlists_lock = threading.Lock()
+
+# videos.list に一度に渡せるIDの上限
+VIDEOS_LIST_MAX_IDS = 50
+
+def chunked(items, size):
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def parse_video_items(data):
+    """
+    videos.list のレスポンスを {video_id: (title, description, channel)} に変換する。
+    """
+    infos = {}
+    for item in data.get("items", []):
+        snippet = item.get("snippet", {})
+        infos[item["id"]] = (
+            snippet.get("title", ""),
+            snippet.get("description", ""),
+            snippet.get("channelTitle", ""),
+        )
+    return infos
+
+def fetch_video_chunk(video_ids, api_key):
+    params = {"key": api_key, "id": ",".join(video_ids), "part": "snippet"}
+    try:
+        resp = get_session().get(f"{YOUTUBE_API_BASE}/videos", params=params)
+        resp.raise_for_status()
+        return parse_video_items(resp.json())
+    except Exception as e:
+        print(f"[ERROR] Exception in get_video_infos: {e}")
+        return {}
+
+def get_video_infos(video_ids, api_key, max_workers=4):
+    """
+    複数動画のメタデータを50件ずつまとめて取得する。
+    N件の動画に対してAPI呼び出しはceil(N/50)回で済む。
+    戻り値は {video_id: (title, description, channel)}。取得できなかった動画は含まれない。
+    """
+    # 重複を除きつつ順序を保つ
+    unique_ids = list(dict.fromkeys(video_ids))
+    chunks = chunked(unique_ids, VIDEOS_LIST_MAX_IDS)
+    if not chunks:
+        return {}
+    infos = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        for chunk_infos in executor.map(lambda chunk: fetch_video_chunk(chunk, api_key), chunks):
+            infos.update(chunk_infos)
+    missing = [video_id for video_id in unique_ids if video_id not in infos]
+    if missing:
+        print(f"[DEBUG] No video info found for video_ids={missing}")
+    print(f"[DEBUG] Fetched video info for {len(infos)} videos in {len(chunks)} request(s)")
+    return infos
+
+def normalize_timestamp(value):
+    """
+    ISO 8601の日時をUTCの "YYYY-MM-DDTHH:MM:SSZ" にそろえる（文字列のまま大小比較できるように）。
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def is_newer(video, watermark):
+    """
+    videoがウォーターマーク（前回までに見た最新動画）より新しいかどうか。
+    """
+    if not watermark:
+        return True
+    if video["video_id"] == watermark.get("video_id"):
+        return False
+    published_at = video.get("published_at")
+    last_published_at = watermark.get("published_at")
+    return not (published_at and last_published_at and published_at <= last_published_at)
+
+def parse_search_items(data):
+    return [
+        {
+            "video_id": item["id"]["videoId"],
+            "published_at": normalize_timestamp(item.get("snippet", {}).get("publishedAt")),
+        }
+        for item in data.get("items", [])
+        if item["id"]["kind"] == "youtube#video"
+    ]
+
+def search_videos(channel_id, api_key, max_results=3, watermark=None, max_backlog=None):
+    """
+    search.list で新しい順に動画を取得する。
+    watermarkがあればpublishedAfterでそれより新しい動画だけを全ページ取得する。
+    途中のページで失敗した場合は例外を送出する（取得できた分だけでウォーターマークを進めないため）。
+    """
+    max_backlog = max_backlog or WATERMARK_MAX_BACKLOG
+    params = {
+        "key": api_key,
+        "channelId": channel_id,
+        "part": "snippet,id",
+        "order": "date",
+        "maxResults": max_results,
+    }
+    if watermark and watermark.get("published_at"):
+        params.update(publishedAfter=watermark["published_at"], maxResults=50, type="video")
+    videos = []
+    while True:
+        resp = get_session().get(f"{YOUTUBE_API_BASE}/search", params=params)
+        resp.raise_for_status()
+        data = resp.json()
+        videos.extend(video for video in parse_search_items(data) if is_newer(video, watermark))
+        page_token = data.get("nextPageToken")
+        if not watermark or not page_token or len(videos) >= max_backlog:
+            return videos[:max_backlog]
+        params["pageToken"] = page_token
+
+def search_video_ids(channel_id, api_key, max_results=3):
+    return [video["video_id"] for video in search_videos(channel_id, api_key, max_results)]
+
+def _load_uploads_playlists():
+    global _uploads_playlists
+    if _uploads_playlists is None:
+        try:
+            with open(UPLOADS_PLAYLIST_CACHE, encoding="utf-8") as f:
+                _uploads_playlists = json.load(f)
+        except (OSError, ValueError):
+            _uploads_playlists = {}
+    return _uploads_playlists
+
+def _save_uploads_playlists():
+    try:
+        with open(UPLOADS_PLAYLIST_CACHE, "w", encoding="utf-8") as f:
+            json.dump(_uploads_playlists, f)
+    except OSError as e:
+        print(f"[ERROR] Failed to write uploads playlist cache: {e}")
+
+def cached_uploads_playlist_id(channel_id):
+    with _uploads_playlists_lock:
+        return _load_uploads_playlists().get(channel_id)
+
+def remember_uploads_playlist_id(channel_id, playlist_id):
+    with _uploads_playlists_lock:
+        _load_uploads_playlists()[channel_id] = playlist_id
+        _save_uploads_playlists()
+
+def parse_uploads_playlist_id(data):
+    items = data.get("items", [])
+    if not items:
+        return None
+    return items[0]["contentDetails"]["relatedPlaylists"]["uploads"]
+
+def get_uploads_playlist_id(channel_id, api_key):
+    """
+    チャンネルのアップロード再生リストIDを返す。
+    一度解決したIDはプロセス内とキャッシュファイルに保存し、以降はAPIを呼ばない。
+    """
+    cached = cached_uploads_playlist_id(channel_id)
+    if cached:
+        return cached
+    params = {"key": api_key, "id": channel_id, "part": "contentDetails"}
+    resp = get_session().get(f"{YOUTUBE_API_BASE}/channels", params=params)
+    resp.raise_for_status()
+    playlist_id = parse_uploads_playlist_id(resp.json())
+    if not playlist_id:
+        print(f"[DEBUG] No channel found for channel_id={channel_id}")
+        return None
+    remember_uploads_playlist_id(channel_id, playlist_id)
+    return playlist_id
+
+def parse_playlist_items(data):
+    return [
+        {
+            "video_id": item["contentDetails"]["videoId"],
+            "published_at": normalize_timestamp(item["contentDetails"].get("videoPublishedAt")),
+        }
+        for item in data.get("items", [])
+        if "contentDetails" in item
+    ]
+
+def playlist_videos(channel_id, api_key, max_results=3, watermark=None, max_backlog=None):
+    """
+    アップロード再生リストを新しい順に読む。
+    watermarkがあれば、それに追いつくまでページをたどって新しい動画をすべて返す。
+    途中のページで失敗した場合は例外を送出する。
+    """
+    max_backlog = max_backlog or WATERMARK_MAX_BACKLOG
+    playlist_id = get_uploads_playlist_id(channel_id, api_key)
+    if not playlist_id:
+        return []
+    params = {
+        "key": api_key,
+        "playlistId": playlist_id,
+        "part": "contentDetails",
+        "maxResults": 50 if watermark else max_results,
+    }
+    videos = []
+    while True:
+        resp = get_session().get(f"{YOUTUBE_API_BASE}/playlistItems", params=params)
+        resp.raise_for_status()
+        data = resp.json()
+        for video in parse_playlist_items(data):
+            if not is_newer(video, watermark):
+                return videos
+            videos.append(video)
+        page_token = data.get("nextPageToken")
+        if not watermark or not page_token or len(videos) >= max_backlog:
+            return videos[:max_backlog]
+        params["pageToken"] = page_token
+
+def playlist_video_ids(channel_id, api_key, max_results=3):
+    return [video["video_id"] for video in playlist_videos(channel_id, api_key, max_results)]
+
+def parse_rss_entries(xml_text):
+    import xml.etree.ElementTree as ET
+    root = ET.fromstring(xml_text)
+    videos = []
+    for entry in root.findall("atom:entry", RSS_NAMESPACES):
+        video_id = entry.findtext("yt:videoId", namespaces=RSS_NAMESPACES)
+        if video_id:
+            published_at = entry.findtext("atom:published", namespaces=RSS_NAMESPACES)
+            videos.append({"video_id": video_id, "published_at": normalize_timestamp(published_at)})
+    return videos
+
+def rss_videos(channel_id, api_key=None, max_results=3, watermark=None, max_backlog=None):
+    """
+    RSSフィード（最新15件）から動画を取得する。watermarkがあればそれより新しい動画をすべて返す。
+    """
+    resp = get_session().get(YOUTUBE_RSS_URL, params={"channel_id": channel_id})
+    resp.raise_for_status()
+    videos = parse_rss_entries(resp.text)
+    if not watermark:
+        return videos[:max_results]
+    return [video for video in videos if is_newer(video, watermark)][:max_backlog or WATERMARK_MAX_BACKLOG]
+
+def rss_video_ids(channel_id, api_key=None, max_results=3):
+    return [video["video_id"] for video in rss_videos(channel_id, api_key, max_results)]
+
+DISCOVERY_BACKENDS = {
+    "search": search_video_ids,
+    "playlist": playlist_video_ids,
+    "rss": rss_video_ids,
+}
+
+def discover_video_ids(channel_id, api_key, max_results=3, backend=None):
+    """
+    選択したバックエンドでチャンネルの最新動画IDを取得する。
+    """
+    backend = backend or DISCOVERY_BACKEND
+    if backend not in DISCOVERY_BACKENDS:
+        raise ValueError(f"Unknown discovery backend: {backend}")
+    try:
+        return DISCOVERY_BACKENDS[backend](channel_id, api_key, max_results)
+    except Exception as e:
+        print(f"[ERROR] Exception in discover_video_ids: {e}")
+        return []
+
+INCREMENTAL_BACKENDS = {
+    "search": search_videos,
+    "playlist": playlist_videos,
+    "rss": rss_videos,
+}
+
+def discover_new_videos(channel_id, api_key, watermark=None, max_results=3, backend=None, max_backlog=None):
+    """
+    ウォーターマークより新しい動画（{"video_id", "published_at"}、新しい順）を返す。
+    ウォーターマークがない初回はmax_results件だけ取得する。
+    取得に失敗した場合は例外をそのまま送出する（呼び出し側はそのチャンネルのウォーターマークを進めない）。
+    """
+    backend = backend or DISCOVERY_BACKEND
+    if backend not in INCREMENTAL_BACKENDS:
+        raise ValueError(f"Unknown discovery backend: {backend}")
+    videos = INCREMENTAL_BACKENDS[backend](channel_id, api_key, max_results, watermark, max_backlog)
+    print(f"[DEBUG] Discovered {len(videos)} new video(s) for channel_id={channel_id}")
+    return videos
@@ -0,0 +1,118 @@
+import atexit
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+# yt-dlpのキャッシュ（プレイヤーJSや署名の解読結果）の保存先。Lambdaでは/tmpだけが書き込める
+YTDLP_CACHE_DIR = os.environ.get(
+    "YTDLP_CACHE_DIR",
+    "/tmp/yt_dlp_cache" if os.environ.get("AWS_LAMBDA_FUNCTION_NAME") else "yt_dlp_cache",
+)
+# 同じオプションで同時に使えるYoutubeDLインスタンスの数
+YTDLP_POOL_SIZE = int(os.environ.get("YTDLP_POOL_SIZE", "2"))
+# "1"なら字幕の一覧だけが必要な軽量な抽出を行う（"0"で従来どおりすべてのフォーマットを解決する）
+YTDLP_LEAN_EXTRACTION = os.environ.get("YTDLP_LEAN_EXTRACTION", "1") == "1"
+
+# 字幕の取得だけに必要なオプション。
+# プレイヤーJS（署名の解読）とHLS/DASHのマニフェストは動画フォーマットにしか使わないので取得しない
+CAPTION_ONLY_OPTIONS = {
+    'skip_download': True,
+    'quiet': True,
+    'noplaylist': True,
+    'check_formats': False,
+    'extractor_args': {'youtube': {'skip': ['hls', 'dash'], 'player_skip': ['js']}},
+}
+
+_pools = {}
+_lock = threading.Lock()
+
+class YoutubeDLPool:
+    """
+    YoutubeDLインスタンスを使い回すプール。
+    インスタンスの生成（エクストラクタやCookieの初期化）は重いので、必要になった分だけ作って保持する。
+    YoutubeDLはスレッドセーフではないので、1つのインスタンスは同時に1スレッドだけが使う。
+    """
+
+    def __init__(self, options, size=YTDLP_POOL_SIZE):
+        self.options = dict(options, cachedir=options.get("cachedir", YTDLP_CACHE_DIR))
+        self.size = max(1, size)
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _create(self):
+        # yt_dlpは読み込みが重いので最初にインスタンスを作るときにimportする
+        import yt_dlp
+        return yt_dlp.YoutubeDL(self.options)
+
+    @contextmanager
+    def acquire(self):
+        """
+        空いているインスタンスを貸し出す。上限まで作成済みで空きがなければ返却を待つ。
+        """
+        try:
+            ydl = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                try:
+                    ydl = self._create()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                ydl = self.idle.get()
+        try:
+            yield ydl
+        finally:
+            self.idle.put(ydl)
+
+    def close(self):
+        while True:
+            try:
+                ydl = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                ydl.close()
+            except Exception as e:
+                print(f"[ERROR] Failed to close YoutubeDL: {e}")
+
+def extract_caption_tracks(url, options=None, lean=None):
+    """
+    動画の字幕トラックの一覧だけを取得し、{"subtitles", "automatic_captions"} を返す。
+    lean=Trueのときはフォーマットの選択・検証（process）を行わず、大きなinfo dictもすぐに手放す。
+    """
+    lean = YTDLP_LEAN_EXTRACTION if lean is None else lean
+    if options is None:
+        options = CAPTION_ONLY_OPTIONS if lean else {'skip_download': True, 'quiet': True}
+    with get_ytdlp_pool(options).acquire() as ydl:
+        info = ydl.extract_info(url, download=False, process=not lean)
+    return {
+        'subtitles': info.get('subtitles') or {},
+        'automatic_captions': info.get('automatic_captions') or {},
+    }
+
+def get_ytdlp_pool(options):
+    """
+    オプションごとに1つのプールを共有する（ウォームスタート間でも再利用される）。
+    """
+    key = json.dumps(options, sort_keys=True, default=str)
+    with _lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = YoutubeDLPool(options)
+            _pools[key] = pool
+        return pool
+
+@atexit.register
+def _close_pools():
+    with _lock:
+        for pool in _pools.values():
+            pool.close()
@@ -0,0 +1,63 @@
+import json
+from caption_parser import parse_captions, parse_json3, parse_vtt
+
+ROLLING_VTT = """WEBVTT
+Kind: captions
+Language: ja
+
+00:00:00.000 --> 00:00:02.000 align:start position:0%
+ 
+こんにちは<00:00:00.500><c>皆さん</c>
+
+00:00:02.000 --> 00:00:02.010 align:start position:0%
+こんにちは皆さん
+ 
+
+00:00:02.010 --> 00:00:04.000 align:start position:0%
+こんにちは皆さん
+今日は<00:00:02.500><c>Lambdaの話です</c>
+
+00:00:04.000 --> 00:00:04.010 align:start position:0%
+今日はLambdaの話です
+ 
+"""
+
+def test_vtt_rolling_duplicates_are_removed():
+    texts = [segment["text"] for segment in parse_captions(ROLLING_VTT.splitlines(), "vtt")]
+    assert texts == ["こんにちは皆さん", "今日はLambdaの話です"]
+
+def test_vtt_keeps_timings_of_first_occurrence():
+    segments = list(parse_captions(ROLLING_VTT.splitlines(), "vtt"))
+    assert segments[0]["start"] == 0.0
+    assert segments[1]["start"] == 2.01
+
+def test_vtt_numeral_leading_lines_are_text_not_cue_ids():
+    vtt = """WEBVTT
+
+1
+00:00:01.000 --> 00:00:02.000
+2024年の売上は
+10:00から始めます
+
+2
+00:01:00.000 --> 00:01:01.500
+3つのポイント
+"""
+    segments = list(parse_vtt(vtt.splitlines()))
+    assert [segment["text"] for segment in segments] == ["2024年の売上は", "10:00から始めます", "3つのポイント"]
+    assert segments[2] == {"text": "3つのポイント", "start": 60.0, "duration": 1.5}
+
+def test_vtt_skips_note_and_style_blocks():
+    vtt = "WEBVTT\n\nNOTE これはコメント\n続き\n\nSTYLE\n::cue { color: red }\n\n00:00.000 --> 00:01.000\n本文\n"
+    assert [segment["text"] for segment in parse_vtt(vtt.splitlines())] == ["本文"]
+
+def test_json3_is_parsed_from_arbitrary_chunks():
+    events = [
+        {"tStartMs": i * 1000, "dDurationMs": 900, "segs": [{"utf8": f"行{i} \"引用\" ]}}"}]} if i % 2 else {"tStartMs": i * 1000}
+        for i in range(50)
+    ]
+    text = json.dumps({"wireMagic": "pb3", "pens": [{}], "events": events}, ensure_ascii=False, indent=2)
+    expected = [f"行{i} \"引用\" ]}}" for i in range(1, 50, 2)]
+    for size in (1, 7, 64, len(text)):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert [segment["text"] for segment in parse_json3(chunks)] == expected
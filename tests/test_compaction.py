@@ -0,0 +1,46 @@
+from compaction import OMISSION_MARK, dedupe_lines, normalize_line, trim_to_budget
+from summarizer import estimate_tokens
+
+LINES = [f"行{i} {'データベースインデックス最適化' if i % 7 == 0 else 'ランダム'} 2024" for i in range(100)]
+
+def test_trim_to_budget_returns_lines_under_budget_unchanged():
+    assert trim_to_budget(LINES[:5], 1000) == LINES[:5]
+
+def test_trim_to_budget_fits_budget_and_keeps_edges():
+    trimmed = trim_to_budget(LINES, 200, edge_ratio=0.15)
+    assert estimate_tokens("\n".join(trimmed)) <= 200
+    assert trimmed[0] == LINES[0]
+    assert trimmed[-1] == LINES[-1]
+
+def test_trim_to_budget_counts_marks_and_newlines():
+    lines = [f"{i}番目の話題 テスト{i}" if i % 3 else "はい" for i in range(2000)]
+    for budget in (50, 500, 5000):
+        assert estimate_tokens("\n".join(trim_to_budget(lines, budget))) <= budget
+
+def test_trim_to_budget_keeps_order_and_marks_gaps():
+    trimmed = trim_to_budget(LINES, 200)
+    kept = [line for line in trimmed if line != OMISSION_MARK]
+    assert kept == [line for line in LINES if line in kept]
+    assert OMISSION_MARK in trimmed
+    # 省略の印は連続しない
+    assert all(not (a == b == OMISSION_MARK) for a, b in zip(trimmed, trimmed[1:]))
+
+def test_trim_to_budget_prefers_informative_lines():
+    informative = [f"Lambda{i} コールドスタート 対策 {i}" for i in range(10)]
+    lines = []
+    for line in informative:
+        lines.extend([line, "はい、そうですね、そうなんですよね", "うんうん、なるほどなるほど"])
+    # 有益な行と、その後ろの省略の印がちょうど収まる予算
+    budget = sum(estimate_tokens(line) + 1 for line in informative) + len(informative) * (estimate_tokens(OMISSION_MARK) + 1)
+    trimmed = trim_to_budget(lines, budget, edge_ratio=0)
+    assert estimate_tokens("\n".join(trimmed)) <= budget
+    assert [line for line in trimmed if line != OMISSION_MARK] == informative
+
+def test_dedupe_lines_replaces_rolled_up_line():
+    lines = ["今日はですね", "今日はですね、Lambdaの話", "今日はですね、Lambdaの話", "はい", "はい"]
+    assert list(dedupe_lines(lines)) == ["今日はですね、Lambdaの話", "はい"]
+
+def test_normalize_line_removes_filler_without_small_tsu():
+    assert normalize_line("えーと、はい") == "はい"
+    assert normalize_line("えーっと、はい") == "はい"
+    assert normalize_line("えと、はい") == "はい"
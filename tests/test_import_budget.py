@@ -0,0 +1,8 @@
+import import_budget
+
+def test_entry_modules_do_not_load_heavy_libraries():
+    # import時間はマシンに依存するので表示だけにし、重いライブラリを起動時に読み込んでいないことだけを確認する
+    for module in import_budget.ENTRY_MODULES:
+        elapsed_ms, loaded = import_budget.measure(module)
+        print(f"{module}: {elapsed_ms:.1f} ms")
+        assert [name for name in import_budget.HEAVY_MODULES if name in loaded] == []
@@ -0,0 +1,34 @@
+import json
+from notion_blocks import NOTION_TEXT_LIMIT, chunk_blocks, iter_text_pieces, page_blocks
+
+def _length(text):
+    return len(text.encode("utf-16-le")) // 2
+
+def test_iter_text_pieces_respects_limit_and_keeps_text():
+    text = "\n".join("あ" * n for n in (10, 1999, 2000, 2001, 4500, 3))
+    pieces = list(iter_text_pieces(text))
+    assert all(_length(piece) <= NOTION_TEXT_LIMIT for piece in pieces)
+    assert "".join(pieces).replace("\n", "") == text.replace("\n", "")
+
+def test_iter_text_pieces_counts_astral_characters_as_two():
+    pieces = list(iter_text_pieces("😀" * 1500))
+    assert [_length(piece) for piece in pieces] == [2000, 1000]
+
+def test_iter_text_pieces_accepts_segments():
+    segments = [{"text": "一行目"}, {"text": "二行目"}]
+    assert list(iter_text_pieces(segments)) == ["一行目\n二行目"]
+
+def test_chunk_blocks_caps_block_count():
+    assert [len(chunk) for chunk in chunk_blocks(range(250))] == [100, 100, 50]
+
+def test_chunk_blocks_caps_payload_bytes():
+    caption = "\n".join("日本語の字幕です。" * 200 for _ in range(300))
+    chunks = list(chunk_blocks(page_blocks("要約", caption), max_bytes=100 * 1024))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 100
+        assert len(json.dumps(chunk, ensure_ascii=False).encode("utf-8")) <= 100 * 1024
+
+def test_chunk_blocks_emits_oversized_block_alone():
+    big = {"text": "x" * 1000}
+    assert [len(chunk) for chunk in chunk_blocks([big, big, big], max_bytes=500)] == [1, 1, 1]
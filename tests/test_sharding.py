@@ -0,0 +1,38 @@
+import pytest
+from sharding import partition_channels, select_shard
+
+CHANNELS = [{"id": f"UC{i:022d}"} for i in range(200)]
+
+def _assignment(shards):
+    return {channel["id"]: index for index, members in enumerate(shards) for channel in members}
+
+def test_partition_is_deterministic():
+    assert partition_channels(CHANNELS, 4) == partition_channels(list(CHANNELS), 4)
+
+def test_partition_covers_every_channel_once_and_keeps_order():
+    shards = partition_channels(CHANNELS, 4)
+    assert sorted(channel["id"] for members in shards for channel in members) == sorted(c["id"] for c in CHANNELS)
+    order = {channel["id"]: i for i, channel in enumerate(CHANNELS)}
+    for members in shards:
+        assert [order[c["id"]] for c in members] == sorted(order[c["id"]] for c in members)
+
+def test_adding_a_shard_moves_few_channels():
+    before = _assignment(partition_channels(CHANNELS, 4))
+    after = _assignment(partition_channels(CHANNELS, 5))
+    moved = sum(1 for channel_id in before if before[channel_id] != after[channel_id])
+    # 理想は1/5が移動する。全体を振り直す方式（約4/5が移動）よりずっと少ないことを確認する
+    assert moved < len(CHANNELS) * 0.35
+
+def test_adding_a_channel_does_not_move_others():
+    before = _assignment(partition_channels(CHANNELS, 4))
+    after = _assignment(partition_channels(CHANNELS + [{"id": "UCnew"}], 4))
+    assert all(after[channel_id] == shard for channel_id, shard in before.items())
+
+@pytest.mark.parametrize("count", [0, -1, 1.5, "2"])
+def test_invalid_shard_count(count):
+    with pytest.raises(ValueError):
+        partition_channels(CHANNELS, count)
+
+def test_select_shard_rejects_out_of_range():
+    with pytest.raises(ValueError):
+        select_shard(CHANNELS, 4, 4)
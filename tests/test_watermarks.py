@@ -0,0 +1,58 @@
+from watermarks import WatermarkStore, merge_watermarks
+
+VIDEOS = [
+    {"video_id": "c", "published_at": "2024-05-03T00:00:00Z"},
+    {"video_id": "a", "published_at": "2024-05-01T00:00:00Z"},
+    {"video_id": "b", "published_at": "2024-05-02T00:00:00Z"},
+]
+
+def _store(tmp_path):
+    return WatermarkStore(str(tmp_path / "watermarks.json"))
+
+def test_advance_moves_to_newest(tmp_path):
+    store = _store(tmp_path)
+    store.advance("ch", VIDEOS)
+    assert store.get("ch") == {"video_id": "c", "published_at": "2024-05-03T00:00:00Z"}
+
+def test_advance_never_moves_backwards(tmp_path):
+    store = _store(tmp_path)
+    store.advance("ch", VIDEOS)
+    store.advance("ch", [{"video_id": "old", "published_at": "2024-04-01T00:00:00Z"}])
+    assert store.get("ch")["video_id"] == "c"
+
+def test_advance_stops_before_oldest_unfinished_video(tmp_path):
+    store = _store(tmp_path)
+    store.advance("ch", VIDEOS, completed={"a", "c"})
+    assert store.get("ch")["video_id"] == "a"
+    store.advance("other", VIDEOS, completed={"b", "c"})
+    assert store.get("other") is None
+
+def test_advance_completed_only_touches_tracked_channels(tmp_path):
+    store = _store(tmp_path)
+    store.track("ch", VIDEOS)
+    store.advance_completed({"a", "b", "c"})
+    assert store.get("ch")["video_id"] == "c"
+    assert store.discovered == {}
+    store.advance_completed({"x"})
+    assert store.get("ch")["video_id"] == "c"
+
+def test_save_and_reload(tmp_path):
+    store = _store(tmp_path)
+    store.advance("ch", VIDEOS)
+    store.save()
+    assert _store(tmp_path).get("ch")["video_id"] == "c"
+
+def test_hooks_restore_and_merge_on_save(tmp_path):
+    exported = []
+    remote = {"ch": {"video_id": "b", "published_at": "2024-05-02T00:00:00Z"}}
+    store = WatermarkStore(str(tmp_path / "watermarks.json"), lambda: remote, exported.append)
+    assert store.get("ch")["video_id"] == "b"
+    store.advance("ch", VIDEOS)
+    store.save()
+    assert exported == [{"ch": {"video_id": "c", "published_at": "2024-05-03T00:00:00Z"}}]
+
+def test_merge_watermarks_keeps_newest_per_channel():
+    current = {"ch": {"video_id": "c", "published_at": "2024-05-03T00:00:00Z"}, "x": {"video_id": "x"}}
+    merged = merge_watermarks(current, {"ch": {"video_id": "a", "published_at": "2024-05-01T00:00:00Z"}, "y": {"video_id": "y"}})
+    assert merged["ch"]["video_id"] == "c"
+    assert set(merged) == {"ch", "x", "y"}
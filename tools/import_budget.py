@@ -0,0 +1,81 @@
+"""
+モジュールごとのimport時間を計測して、コールドスタートの予算を超えていないか確認する。
+
+    python tools/import_budget.py [module ...]
+
+各モジュールを新しいプロセスで `python -X importtime` により読み込み、累積のimport時間と、
+起動時に読み込まれてしまった重いライブラリを表示する。予算超過や重いライブラリの
+読み込みがあれば終了コード1を返す。
+"""
+import os
+import subprocess
+import sys
+
+# 計測するLambdaのモジュールの場所（このスクリプト自体はLambdaのzipに含めない開発用ツール）
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# エントリーポイントごとのimport時間の上限（ミリ秒）
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", "300"))
+
+ENTRY_MODULES = [
+    "lambda_function",
+    "lambda_function_single",
+    "lambda_function_yt",
+]
+# 最初に使うステージまで読み込みを遅らせるべきライブラリ
+HEAVY_MODULES = [
+    "google.generativeai",
+    "google.api_core",
+    "grpc",
+    "notion_client",
+    "youtube_transcript_api",
+    "yt_dlp",
+    "xml.etree.ElementTree",
+]
+
+def measure(module):
+    """
+    moduleを新しいプロセスでimportし、(累積時間ms, 読み込まれたモジュール名のset) を返す。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    cumulative_us = 0
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue
+        loaded.add(name)
+        if name == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, loaded
+
+def main(modules=None):
+    modules = modules or ENTRY_MODULES
+    ok = True
+    print(f"{'module':<28}{'import ms':>10}  heavy imports")
+    for module in modules:
+        try:
+            elapsed_ms, loaded = measure(module)
+        except RuntimeError as e:
+            print(f"[ERROR] {e}")
+            ok = False
+            continue
+        heavy = [name for name in HEAVY_MODULES if name in loaded]
+        over = elapsed_ms > IMPORT_BUDGET_MS
+        ok = ok and not over and not heavy
+        flag = " (over budget)" if over else ""
+        print(f"{module:<28}{elapsed_ms:>10.1f}  {', '.join(heavy) or '-'}{flag}")
+    print(f"budget: {IMPORT_BUDGET_MS:.0f} ms per module")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))